@@ -74,9 +74,9 @@ def add_parser(subp, fclass):
                       help='print config file and exit')
 
 
-def read_config():
-    """Read a configuration file."""
-    cfg_file = configparser.ConfigParser(allow_no_value=True)
+def _config_location():
+    """Helper function for read_config. Returns the directory and
+    the name of the configuration file to be used. """
     name = 'lexor.config'
     if CONFIG['cfg_user']:
         path = os.environ['HOME']
@@ -93,17 +93,61 @@ def read_config():
         path = CONFIG['cfg_path']
         if not os.path.exists('%s/%s' % (path, name)):
             error("ERROR: %s/%s does not exist.\n" % (path, name))
+    return path, name
+
+
+def read_config():
+    """Read a configuration file."""
+    cfg_file = configparser.ConfigParser(allow_no_value=True)
+    path, name = _config_location()
     cfg_file.read('%s/%s' % (path, name))
     CONFIG['name'] = name
     CONFIG['path'] = path
     return cfg_file
 
 
+def read_config_snapshot():
+    """Return a dictionary mapping the sections of the configuration
+    file to dictionaries with their values already expanded with
+    `os.path.expandvars`. The snapshot is kept in memory and the file
+    is only read again if its real path, modification time or size
+    changes. Do not modify the returned dictionary, use `read_config`
+    to obtain an object that can be edited and written. """
+    path, name = _config_location()
+    CONFIG['name'] = name
+    CONFIG['path'] = path
+    fname = '%s/%s' % (path, name)
+    realpath = os.path.realpath(fname)
+    try:
+        stat = os.stat(realpath)
+        stamp = (realpath, stat.st_mtime, stat.st_size)
+    except OSError:
+        stamp = (realpath, None, None)
+    cache = read_config_snapshot.cache
+    if cache.get('stamp') == stamp:
+        return cache['snapshot']
+    cfg_file = configparser.ConfigParser(allow_no_value=True)
+    cfg_file.read(fname)
+    snapshot = dict()
+    for sec in cfg_file.sections():
+        snapshot[sec] = dict()
+        for var, val in cfg_file[sec].iteritems():
+            if val is not None:
+                val = os.path.expandvars(val)
+            snapshot[sec][var] = val
+    cache['stamp'] = stamp
+    cache['snapshot'] = snapshot
+    return snapshot
+if not hasattr(read_config_snapshot, 'cache'):
+    read_config_snapshot.cache = dict()
+
+
 def write_config(cfg_file):
     "Write the configuration file. "
     fname = '%s/%s' % (CONFIG['path'], CONFIG['name'])
     with open(fname, 'w') as tmp:
         cfg_file.write(tmp)
+    read_config_snapshot.cache.clear()
 
 
 def run():
@@ -146,11 +190,10 @@ def update_single(cfg, name, defaults=None):
             pass
 
 
-def _update_from_file(cfg, name, cfg_file):
+def _update_from_file(cfg, name, snapshot):
     "Helper function for get_cfg."
-    if name in cfg_file:
-        for var, val in cfg_file[name].iteritems():
-            cfg[name][var] = os.path.expandvars(val)
+    if name in snapshot:
+        cfg[name].update(snapshot[name])
 
 
 def _update_from_arg(cfg, argdict, key):
@@ -167,21 +210,20 @@ def get_cfg(names, defaults=None):
             'path': ''
         }
     }
-    cfg_file = read_config()
-    if 'lexor' in cfg_file:
-        for var, val in cfg_file['lexor'].iteritems():
-            cfg['lexor'][var] = os.path.expandvars(val)
+    snapshot = read_config_snapshot()
+    if 'lexor' in snapshot:
+        cfg['lexor'].update(snapshot['lexor'])
     cfg['lexor']['root'] = CONFIG['path']
     if isinstance(names, list):
         for name in names:
             cfg[name] = dict()
             update_single(cfg, name)
-            _update_from_file(cfg, name, cfg_file)
+            _update_from_file(cfg, name, snapshot)
     else:
         if names != 'lexor':
             cfg[names] = dict()
             update_single(cfg, names, defaults)
-            _update_from_file(cfg, names, cfg_file)
+            _update_from_file(cfg, names, snapshot)
     if CONFIG['arg']:
         argdict = vars(CONFIG['arg'])
         if argdict['parser_name'] in cfg:
@@ -201,10 +243,9 @@ def set_style_cfg(obj, name, defaults):
         mod_defaults = obj.style_module.DEFAULTS
         for var, val in mod_defaults.iteritems():
             obj.defaults[var] = os.path.expandvars(str(val))
-    cfg_file = read_config()
-    if name in cfg_file:
-        for var, val in cfg_file[name].iteritems():
-            obj.defaults[var] = os.path.expandvars(val)
+    snapshot = read_config_snapshot()
+    if name in snapshot:
+        obj.defaults.update(snapshot[name])
     if defaults:
         for var, val in defaults.iteritems():
             obj.defaults[var] = val
@@ -137,8 +137,80 @@ def _get_info(cfg, type_, lang, style, to_lang=None):
     return key, name, modname
 
 
+def _load_style(modname, path):
+    """Helper function for get_style_module. Returns the module
+    stored in the style cache if the file located at `path` has not
+    been modified since it was loaded. Otherwise the module is loaded
+    with `load_source` and stored in the cache. Raises `IOError` if
+    the file does not exist.
+
+    The cache is keyed by `(modname, path)`. Since `load_source`
+    executes the file into `sys.modules[modname]`, loading a module
+    removes every other entry which shares its `modname`. """
+    path = os.path.realpath(path)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        raise IOError('no such file: %s' % path)
+    key = (modname, path)
+    try:
+        mod, cached_mtime = _load_style.cache[key]
+        if cached_mtime == mtime:
+            return mod
+    except KeyError:
+        pass
+    for other in _load_style.cache.keys():
+        if other[0] == modname:
+            del _load_style.cache[other]
+    mod = load_source(modname, path)
+    _load_style.cache[key] = (mod, mtime)
+    return mod
+if not hasattr(_load_style, 'cache'):
+    _load_style.cache = dict()
+
+
+def clear_style_cache(path=None):
+    """Remove the modules loaded by `get_style_module` from the style
+    cache. If `path` is provided then only the module loaded from
+    that file is removed. Note that the auxiliary modules loaded by a
+    style are only reloaded when the style itself is reloaded, use
+    this function if you modify them. """
+    if path is None:
+        _load_style.cache.clear()
+    else:
+        path = os.path.realpath(path)
+        for key in _load_style.cache.keys():
+            if key[1] == path:
+                del _load_style.cache[key]
+
+
+def style_stamp(mod):
+    """Return the entry of the style cache for the module `mod` or
+    None if the module is not in the cache. A new entry is created
+    every time the module is loaded, see `style_stamp_is_current`. """
+    key = (getattr(mod, '__name__', None), getattr(mod, '__file__', None))
+    return _load_style.cache.get(key)
+
+
+def style_stamp_is_current(stamp):
+    """Return True if `stamp`, obtained with `style_stamp`, is still
+    the entry of the style cache for its module and the file of the
+    module has not been modified since it was loaded. """
+    if stamp is None:
+        return False
+    path = stamp[0].__file__
+    if _load_style.cache.get((stamp[0].__name__, path)) is not stamp:
+        return False
+    try:
+        return os.stat(path).st_mtime == stamp[1]
+    except OSError:
+        return False
+
+
 def get_style_module(type_, lang, style, to_lang=None):
-    """Return a parsing/writing/converting module. """
+    """Return a parsing/writing/converting module. The modules are
+    cached by their path and modification time, see
+    `clear_style_cache` to force a module to be loaded again. """
     cfg = config.get_cfg(['lang', 'develop', 'version'])
     config.update_single(cfg, 'lang', DEFAULTS)
     key, name, modname = _get_info(cfg, type_, lang, style, to_lang)
@@ -147,7 +219,7 @@ def get_style_module(type_, lang, style, to_lang=None):
             path = cfg['develop'][key]
             if path[0] != '/':
                 path = '%s/%s' % (config.CONFIG['path'], path)
-            return load_source(modname, path)
+            return _load_style(modname, path)
         except (KeyError, IOError):
             pass
     versions = []
@@ -162,11 +234,11 @@ def get_style_module(type_, lang, style, to_lang=None):
             versions += glob('%s/%s*.py' % (base, name))
             path = '%s/%s.py' % (base, name)
         try:
-            return load_source(modname, path)
+            return _load_style(modname, path)
         except IOError:
             continue
     try:
-        mod = load_source(modname, versions[0])
+        mod = _load_style(modname, versions[0])
         mod.VERSIONS = versions
         return mod
     except (IOError, IndexError):
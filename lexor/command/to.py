@@ -188,10 +188,11 @@ def add_parser(subp, fclass):
 
 
 def get_input(input_file, cfg, default='_'):
-    """Returns the text to be parsed along with the name assigned to
-    that text. The last output is the extension of the file. """
+    """Returns a file object with the text to be parsed along with
+    the name assigned to that text. The last output is the extension
+    of the file. """
     if input_file is '_':
-        return sys.stdin.read(), 'STDIN', 'STDIN', default
+        return sys.stdin, 'STDIN', 'STDIN', default
     found = False
     if input_file[0] != '/':
         root = cfg['lexor']['root']
@@ -210,7 +211,7 @@ def get_input(input_file, cfg, default='_'):
             found = True
     if not found:
         error("ERROR: The file '%s' does not exist.\n" % input_file)
-    text = open(abspath, 'r').read()
+    stream = open(abspath, 'r')
     textname = input_file
     path = os.path.realpath(abspath)
     name = os.path.basename(path)
@@ -219,7 +220,7 @@ def get_input(input_file, cfg, default='_'):
     file_ext = name[1][1:].lower()
     if file_ext == '':
         file_ext = default  # The default language to parse
-    return text, textname, file_name, file_ext
+    return stream, textname, file_name, file_ext
 
 
 def run():
@@ -227,7 +228,7 @@ def run():
     arg = config.CONFIG['arg']
     cfg = config.get_cfg(['to', 'edit'])
 
-    text, t_name, f_name, f_ext = get_input(arg.inputfile, cfg)
+    stream, t_name, f_name, f_ext = get_input(arg.inputfile, cfg)
 
     parse_lang = cfg['to']['parse_lang']
     if isinstance(parse_lang, str):
@@ -254,10 +255,13 @@ def run():
               'Using the first module in this list:\n\n  %s\n\n'
         warn(msg % '\n  '.join(versions))
     try:
-        parser.parse(text, t_name)
+        parser.parse_stream(stream, t_name)
     except ImportError:
         msg = "ERROR: Parsing style not found: [%s:%s]\n"
         error(msg % (in_lang, in_style['name']))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
     try:
         write_log(log_writer, parser.log, arg.quiet)
     except ImportError:
@@ -9,6 +9,11 @@ files. Make sure to familiarize yourself with all the objects in this
 module to be able to write extensions for the `Parser`, `Converter`
 and `Writer`.
 
+## builder
+
+The builder module provides the `TreeBuilder` which constructs a
+`Document` from calls to `start`, `data` and `end`.
+
 ## parser
 
 The parser module provides the `Parser` and the abstract class
@@ -44,6 +49,7 @@ from lexor.core.elements import (
     Document,
     DocumentFragment,
 )
+from lexor.core.builder import TreeBuilder
 from lexor.core.parser import (
     NodeParser,
     Parser,
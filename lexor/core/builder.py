@@ -0,0 +1,120 @@
+"""lexor builder
+
+This module provides the `TreeBuilder` object which constructs a
+`Document` from a sequence of calls describing its content.
+
+"""
+
+import sys
+LC = sys.modules['lexor.core']
+
+
+class TreeBuilder(object):
+    """Builds a `Document` in document order. Call `start` to open
+    an element, `data` to add text and `end` to close the last open
+    element:
+
+        builder = TreeBuilder()
+        builder.start('p', {'class': 'note'})
+        builder.data('Some text')
+        builder.end()
+        doc = builder.close()
+
+    The nodes are linked to their previous sibling and appended to
+    the list of child nodes of their parent directly instead of going
+    through `append_child`. The strings given to `data` are
+    collected and joined into a single `Text` node when another node
+    is added, an element is closed or `flush_text` is called. """
+
+    def __init__(self, lang='xml', style='default', doc=None):
+        """Nodes will be appended to `doc`. If `doc` is not provided
+        then a new `Document` with the given language and style is
+        created. """
+        if doc is None:
+            doc = LC.Document(lang, style)
+        self.doc = doc
+        self._crt = doc
+        self._text_node = None
+        self._text_chunks = None
+
+    @property
+    def current(self):
+        """READ-ONLY: The node to which nodes are being appended. """
+        return self._crt
+
+    @staticmethod
+    def attach(parent, node):
+        """Appends `node` to the child nodes of `parent` and returns
+        `node`. This is equivalent to `parent.append_child(node)` but
+        a node which does not have a parent skips the checks done by
+        `append_child` and is handed to `set_parent`. """
+        if node.parent is not None or isinstance(node, LC.DocumentFragment):
+            parent.append_child(node)
+            return node
+        child = parent.child
+        if child:
+            prev = child[-1]
+            prev.next = node
+            node.prev = prev
+            prev.touch()
+        child.append(node)
+        node.set_parent(parent, len(child) - 1)
+        return node
+
+    def flush_text(self):
+        """Joins the strings collected by `data` into the `data` of
+        the last `Text` node. Call this method before inspecting the
+        text of the current node. """
+        if self._text_node is not None:
+            self._text_node.data = ''.join(self._text_chunks)
+            self._text_node.touch()
+            self._text_node = None
+            self._text_chunks = None
+
+    def append(self, node):
+        """Appends a node to the current node without opening it.
+        Returns the node. """
+        self.flush_text()
+        return TreeBuilder.attach(self._crt, node)
+
+    def start(self, name, attrs=None):
+        """Appends a new `Element` to the current node and makes it
+        the current node. `attrs` may be a `dict` or a list of
+        key-value pairs. Returns the new element. """
+        self.flush_text()
+        node = TreeBuilder.attach(self._crt, LC.Element(name, attrs))
+        self._crt = node
+        return node
+
+    def data(self, text):
+        """Appends `text` to the current node. The text is joined to
+        the last child if it is a `Text` node. """
+        child = self._crt.child
+        if child and child[-1] is self._text_node:
+            self._text_chunks.append(text)
+            return
+        self.flush_text()
+        if child and child[-1].name == '#text':
+            self._text_node = child[-1]
+            self._text_chunks = [child[-1].data, text]
+        else:
+            self._text_node = TreeBuilder.attach(self._crt, LC.Text(text))
+            self._text_chunks = [text]
+
+    def end(self):
+        """Closes the current element. Its parent becomes the current
+        node. Returns the closed element. """
+        self.flush_text()
+        node = self._crt
+        if node is self.doc:
+            raise ValueError("there are no open elements")
+        self._crt = node.parent
+        return node
+
+    def close(self):
+        """Returns the document. All the elements must be closed. """
+        self.flush_text()
+        if self._crt is not self.doc:
+            msg = "element `%s` has not been closed" % self._crt.name
+            raise ValueError(msg)
+        return self.doc
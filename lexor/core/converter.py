@@ -330,6 +330,7 @@ class Converter(object):
 
     def _convert(self, doc):
         """Main convert function. """
+        attach = LC.TreeBuilder.attach
         direction = None
         # A doc needs to be copied by default. You may prohibit
         # to copy the children, but there must be a document.
@@ -349,14 +350,14 @@ class Converter(object):
             if direction is 'd':
                 crt = crt.child[0]
                 clone = self._clone_node(crt)
-                crtcopy.append_child(clone)
+                attach(crtcopy, clone)
             elif direction is 'r':
                 if crt.next is None:
                     direction = 'u'
                     continue
                 crt = crt.next
                 clone = self._clone_node(crt)
-                crtcopy.parent.append_child(clone)
+                attach(crtcopy.parent, clone)
             elif direction is 'u':
                 crtcopy = self._end(crtcopy.parent)
                 crtcopy.normalize()
@@ -367,7 +368,7 @@ class Converter(object):
                     continue
                 crt = crt.parent.next
                 clone = self._clone_node(crt)
-                crtcopy.parent.append_child(clone)
+                attach(crtcopy.parent, clone)
             crtcopy = clone
             if self._copy(crt):
                 crtcopy = self._start(crtcopy)
@@ -13,6 +13,65 @@ from lexor.core import Node
 LC = sys.modules['lexor.core']
 
 
+def _get_descendants(node):
+    """Helper function which returns a list of the descendants of
+    `node` in tree order. """
+    nodes = []
+    if not node.child:
+        return nodes
+    crt = node
+    direction = 'd'
+    while True:
+        if direction is 'd':
+            crt = crt.child[0]
+        elif direction is 'r':
+            if crt.next is None:
+                direction = 'u'
+                continue
+            crt = crt.next
+        elif direction is 'u':
+            if crt.parent is node:
+                break
+            if crt.parent.next is None:
+                crt = crt.parent
+                continue
+            crt = crt.parent.next
+        nodes.append(crt)
+        if crt.child:
+            direction = 'd'
+        else:
+            direction = 'r'
+    return nodes
+
+
+def _tree_position(node):
+    """Helper function to sort nodes in tree order. Returns the list
+    of indices of the node and its ancestors starting at the root. """
+    position = []
+    while node.parent is not None:
+        position.append(node.index)
+        node = node.parent
+    position.reverse()
+    return position
+
+
+def sort_in_tree_order(nodes):
+    """Return a list with the nodes sorted in tree order. The nodes
+    are assumed to belong to the same document. If the document has
+    its order labels enabled then they are used to compare the nodes,
+    otherwise the positions of the nodes are computed. """
+    if not nodes:
+        return list()
+    owner = nodes[0].owner
+    if owner is not None and owner.order_labels_ is not None:
+        labels = owner.order_labels
+        try:
+            return sorted(nodes, key=lambda node: labels[node][0])
+        except KeyError:
+            pass
+    return sorted(nodes, key=_tree_position)
+
+
 # pylint: disable=R0904,R0902
 class CharacterData(Node):
     """A simple interface to deal with strings. """
@@ -38,6 +97,7 @@ class CharacterData(Node):
     def node_value(self, value):
         """Setter function for data attribute. """
         self.data = value
+        self.touch()
 
 
 class Text(CharacterData):
@@ -227,6 +287,7 @@ class Element(Node):
             self.__dict__[k] = node.__dict__[k]
             if k not in self._order:
                 self._order.append(k)
+        self.touch()
 
     def __getitem__(self, k):
         """Return the k-th child of this node if `k` is an integer.
@@ -262,18 +323,32 @@ class Element(Node):
         Note: The behaviour of Attribute still applies to a Proper
         Node. """
         if isinstance(k, str):
+            if k in self._order and self.owner:
+                if k == 'id':
+                    self.owner.unregister_id(self)
+                elif k == 'class':
+                    self.owner.unregister_class(self)
             self.__dict__[k] = val
             if k not in self._order:
                 self._order.append(k)
             if k == 'id' and self.owner:
-                self.owner.id_dict[k] = self
+                self.owner.register_id(self)
+            elif k == 'class' and self.owner:
+                self.owner.register_class(self)
+            self.touch()
         else:
             Node.__setitem__(self, k, val)
 
     def __delitem__(self, k):
         if isinstance(k, str):
+            if k in ('id', 'class') and k in self._order and self.owner:
+                if k == 'id':
+                    self.owner.unregister_id(self)
+                else:
+                    self.owner.unregister_class(self)
             self.__dict__.__delitem__(k)
             self._order.remove(k)
+            self.touch()
         else:
             Node.__delitem__(self, k)
 
@@ -293,6 +368,12 @@ class Element(Node):
     def contains(self, obj):
         """Unlike __contains__ (obj in node), this method returns
         True if obj is any of the desendents of the node. """
+        owner = self.owner
+        if owner is not None and owner.order_labels_ is not None:
+            labels = owner.order_labels
+            if self in labels and obj in labels:
+                start, end = labels[self]
+                return start < labels[obj][0] <= end
         if obj.level < self.level + 1:
             return False
         while obj.level > self.level + 1:
@@ -346,9 +427,12 @@ class Element(Node):
             index = self._order.index(old_name)
         else:
             index = old_name  # Assume old_name
+        if 'class' in (self._order[index], new_name) and self.owner:
+            self.owner.invalidate_classes()
         self.__dict__[new_name] = self.__dict__[self._order[index]]
         del self.__dict__[self._order[index]]
         self._order[index] = new_name
+        self.touch()
 
     def clone_node(self, deep=False, normalize=True):
         """Returns a new element"""
@@ -401,6 +485,12 @@ class Element(Node):
         if not self.child:
             return nodes
         patterns = set([i.strip() for i in classname.split()])
+        if patterns and self.owner is self and \
+                self.class_index_ is not None:
+            index = self.class_index
+            postings = sorted([index.get(i, ()) for i in patterns], key=len)
+            nodes = set(postings[0]).intersection(*postings[1:])
+            return sort_in_tree_order(list(nodes))
         crt = self
         direction = 'd'
         while True:
@@ -435,17 +525,18 @@ class Element(Node):
         if children is None:
             lang = keywords.get('writer_lang', 'html')
             style = keywords.get('writer_style', 'plain')
-            writer = LC.Writer(lang, style)
+            defaults = dict()
             if self.owner is not None and self.owner.defaults is not None:
                 for var, val in self.owner.defaults.iteritems():
-                    writer.defaults[var] = os.path.expandvars(str(val))
+                    defaults[var] = os.path.expandvars(str(val))
             for var, val in keywords.iteritems():
-                writer.defaults[var] = os.path.expandvars(str(val))
-            result = ''
-            for child in self.child:
-                writer.write(child)
-                result += str(writer)
-            writer.close()
+                defaults[var] = os.path.expandvars(str(val))
+            writer = LC.Writer.acquire(lang, style, defaults)
+            try:
+                writer.write_nodes(self.child)
+                result = str(writer)
+            finally:
+                writer.release()
             return result
         if isinstance(children, str):
             info = {
@@ -517,13 +608,22 @@ class Document(Element):
 
     def __init__(self, lang='xml', style='default'):
         Element.__init__(self, '#document')
-        self.level = -1
-        self.owner = self
+        self._level = -1
+        self._owner = self
+        self.generation_ = 0
         self.lang = lang
         self.style = style
         self.uri_ = None
         self.defaults = None
-        self.id_dict = dict()
+        self.id_dict_ = dict()
+        self.id_dups_ = set()
+        self.id_stale_ = False
+        self.name_index_ = None
+        self.name_stale_ = False
+        self.class_index_ = None
+        self.class_stale_ = False
+        self.order_labels_ = None
+        self.order_stale_ = False
         self.meta = dict()
         self.temporary = True
 
@@ -584,11 +684,349 @@ class Document(Element):
         lexor.core.elements module. Returns an element object. """
         return Element(tagname, data)
 
+    @property
+    def id_dict(self):
+        """A dictionary mapping the ids to the elements in the
+        document. The elements of a subtree moved in or out of the
+        document are added or removed. Elements sharing an id mark
+        the dictionary as outdated; it is then rebuilt the next time
+        it is requested. """
+        if self.id_stale_:
+            self.id_dict_ = dict()
+            self.id_dups_ = set()
+            self.id_stale_ = False
+            for node in reversed(self._get_nodes_with_id()):
+                if node['id'] in self.id_dict_:
+                    self.id_dups_.add(node['id'])
+                self.id_dict_[node['id']] = node
+        return self.id_dict_
+
+    def _get_nodes_with_id(self):
+        """PRIVATE-METHOD: Return a list of the elements in the
+        document which have an `id` attribute. """
+        nodes = []
+        if not self.child:
+            return nodes
+        crt = self
+        direction = 'd'
+        while True:
+            if direction is 'd':
+                crt = crt.child[0]
+            elif direction is 'r':
+                if crt.next is None:
+                    direction = 'u'
+                    continue
+                crt = crt.next
+            elif direction is 'u':
+                if crt.parent is self:
+                    break
+                if crt.parent.next is None:
+                    crt = crt.parent
+                    continue
+                crt = crt.parent.next
+            if isinstance(crt, Element) and 'id' in crt:
+                nodes.append(crt)
+            if crt.child:
+                direction = 'd'
+            else:
+                direction = 'r'
+        return nodes
+
+    def register_id(self, node):
+        """HELPER-METHOD: Adds `node` to the id dictionary. If
+        another element already has the same id then the dictionary
+        is marked as outdated since the first of them in tree order
+        is the one to be found. """
+        if not self.id_stale_:
+            if self.id_dict_.get(node['id'], node) is not node:
+                self.id_stale_ = True
+            else:
+                self.id_dict_[node['id']] = node
+
+    def unregister_id(self, node):
+        """HELPER-METHOD: Removes `node` from the id dictionary. If
+        other elements have the same id then the dictionary is marked
+        as outdated. """
+        if not self.id_stale_:
+            if node['id'] in self.id_dups_:
+                self.id_stale_ = True
+            elif self.id_dict_.get(node['id']) is node:
+                del self.id_dict_[node['id']]
+
+    def invalidate_ids(self):
+        """HELPER-METHOD: Marks the id dictionary as outdated. """
+        self.id_stale_ = True
+
     def get_element_by_id(self, element_id):
         """Return the first element, in tree order, within the
         document whose ID is element_id, or None if there is none. """
         return self.id_dict.get(element_id, None)
 
+    def enable_name_index(self):
+        """Keep a dictionary mapping the node names to the nodes in
+        the document in tree order. `get_nodes_by_name`, and thus
+        the selector `TAG`, will then use it instead of traversing
+        the document.
+
+        The dictionary is updated when nodes or subtrees are appended
+        or removed. Nodes inserted before the end of the document
+        mark it as outdated and it is rebuilt the next time it is
+        requested. Call `invalidate_names` after
+        modifying the `name` of a node in the document. """
+        if self.name_index_ is None:
+            self.name_index_ = dict()
+            self.name_stale_ = True
+
+    def disable_name_index(self):
+        """Stop maintaining the dictionary of node names. """
+        self.name_index_ = None
+
+    def name_index_enabled(self):
+        """Return True if the document maintains a dictionary of
+        node names. """
+        return self.name_index_ is not None
+
+    @property
+    def name_index(self):
+        """The dictionary mapping the node names to the nodes in the
+        document or `None` if the index is not enabled. """
+        if self.name_stale_ and self.name_index_ is not None:
+            self.name_index_ = dict()
+            self.name_stale_ = False
+            for node in self._get_nodes():
+                try:
+                    self.name_index_[node.name].append(node)
+                except KeyError:
+                    self.name_index_[node.name] = [node]
+        return self.name_index_
+
+    def _get_nodes(self):
+        """PRIVATE-METHOD: Return a list of the nodes in the document
+        in tree order. """
+        return _get_descendants(self)
+
+    def _is_last(self, node):
+        """PRIVATE-METHOD: Return True if no node in the document
+        follows `node` or its descendants in tree order. """
+        crt = node
+        while crt is not self:
+            if crt.parent.child[-1] is not crt:
+                return False
+            crt = crt.parent
+        return True
+
+    def register_name(self, node):
+        """HELPER-METHOD: Adds `node` to the dictionary of node
+        names. This is only possible if it is the last node of the
+        document, otherwise the dictionary is marked as outdated. """
+        if self.name_index_ is None or self.name_stale_:
+            return
+        if not self._is_last(node):
+            self.name_stale_ = True
+            return
+        try:
+            self.name_index_[node.name].append(node)
+        except KeyError:
+            self.name_index_[node.name] = [node]
+
+    def unregister_name(self, node):
+        """HELPER-METHOD: Removes `node` from the dictionary of node
+        names. """
+        if self.name_index_ is None or self.name_stale_:
+            return
+        try:
+            self.name_index_[node.name].remove(node)
+        except (KeyError, ValueError):
+            self.name_stale_ = True
+
+    def register_subtree(self, node):
+        """HELPER-METHOD: Adds `node` and its descendants to the id
+        dictionary and to the dictionaries of node and class names
+        which are enabled. The descendants are only visited if one
+        of the dictionaries is up to date. The dictionary of node
+        names is marked as outdated unless the subtree is at the end
+        of the document. """
+        names = self.name_index_ is not None and not self.name_stale_
+        if names and not self._is_last(node):
+            self.name_stale_ = True
+            names = False
+        classes = self.class_index_ is not None and not self.class_stale_
+        if self.id_stale_ and not names and not classes:
+            return
+        index = self.name_index_
+        for crt in [node] + _get_descendants(node):
+            if names:
+                try:
+                    index[crt.name].append(crt)
+                except KeyError:
+                    index[crt.name] = [crt]
+            if isinstance(crt, Element):
+                if 'id' in crt:
+                    self.register_id(crt)
+                if classes and 'class' in crt:
+                    self.register_class(crt)
+
+    def unregister_subtree(self, node):
+        """HELPER-METHOD: Removes `node` and its descendants from the
+        id dictionary and from the dictionaries of node and class
+        names which are enabled. """
+        names = self.name_index_ is not None and not self.name_stale_
+        classes = self.class_index_ is not None and not self.class_stale_
+        if self.id_stale_ and not names and not classes:
+            return
+        removed = dict()
+        for crt in [node] + _get_descendants(node):
+            if names:
+                try:
+                    removed[crt.name][1] += 1
+                except KeyError:
+                    removed[crt.name] = [crt, 1]
+            if isinstance(crt, Element):
+                if 'id' in crt:
+                    self.unregister_id(crt)
+                if classes and 'class' in crt:
+                    self.unregister_class(crt)
+        # The nodes of the subtree with the same name are contiguous
+        # in the list of that name since the lists are in tree order.
+        index = self.name_index_
+        for name, (first, count) in removed.iteritems():
+            try:
+                start = index[name].index(first)
+            except (KeyError, ValueError):
+                self.name_stale_ = True
+                return
+            del index[name][start:start + count]
+
+    def invalidate_names(self):
+        """HELPER-METHOD: Marks the dictionary of node names as
+        outdated. """
+        self.name_stale_ = True
+
+    def enable_class_index(self):
+        """Keep a dictionary mapping each class name to the set of
+        elements in the document which have it in their `class`
+        attribute. `get_elements_by_class_name`, and thus the
+        selector `.CLASS`, will then intersect the sets of the given
+        class names instead of traversing the document.
+
+        The dictionary is updated when the `class` attribute of an
+        element in the document is set or deleted and when elements
+        or subtrees are appended or removed. """
+        if self.class_index_ is None:
+            self.class_index_ = dict()
+            self.class_stale_ = True
+
+    def disable_class_index(self):
+        """Stop maintaining the dictionary of class names. """
+        self.class_index_ = None
+
+    def class_index_enabled(self):
+        """Return True if the document maintains a dictionary of
+        class names. """
+        return self.class_index_ is not None
+
+    @property
+    def class_index(self):
+        """The dictionary mapping the class names to the elements in
+        the document or `None` if the index is not enabled. """
+        if self.class_stale_ and self.class_index_ is not None:
+            self.class_index_ = dict()
+            self.class_stale_ = False
+            for node in self._get_nodes():
+                if isinstance(node, Element) and 'class' in node:
+                    self.register_class(node)
+        return self.class_index_
+
+    def register_class(self, node):
+        """HELPER-METHOD: Adds `node` to the sets of the class names
+        in its `class` attribute. """
+        if self.class_index_ is None or self.class_stale_:
+            return
+        for name in node['class'].split():
+            try:
+                self.class_index_[name].add(node)
+            except KeyError:
+                self.class_index_[name] = set([node])
+
+    def unregister_class(self, node):
+        """HELPER-METHOD: Removes `node` from the sets of the class
+        names in its `class` attribute. """
+        if self.class_index_ is None or self.class_stale_:
+            return
+        for name in node['class'].split():
+            try:
+                self.class_index_[name].discard(node)
+            except KeyError:
+                pass
+
+    def invalidate_classes(self):
+        """HELPER-METHOD: Marks the dictionary of class names as
+        outdated. """
+        self.class_stale_ = True
+
+    def enable_order_labels(self):
+        """Label every node in the document with the interval
+        `[pre, end]` where `pre` is the position of the node in tree
+        order and `end` is the position of its last descendant. With
+        the labels, `contains` and the sorting of nodes in tree order
+        only compare integers.
+
+        Any node appended to or removed from the document marks the
+        labels as outdated and they are computed again the next time
+        they are requested. """
+        if self.order_labels_ is None:
+            self.order_labels_ = dict()
+            self.order_stale_ = True
+
+    def disable_order_labels(self):
+        """Stop labeling the nodes of the document. """
+        self.order_labels_ = None
+
+    def order_labels_enabled(self):
+        """Return True if the document labels its nodes. """
+        return self.order_labels_ is not None
+
+    @property
+    def order_labels(self):
+        """The dictionary mapping each node in the document to its
+        label or `None` if the labels are not enabled. """
+        if self.order_stale_ and self.order_labels_ is not None:
+            self.order_labels_ = labels = dict()
+            self.order_stale_ = False
+            labels[self] = [0, 0]
+            if not self.child:
+                return labels
+            num = 0
+            crt = self
+            direction = 'd'
+            while True:
+                if direction is 'd':
+                    crt = crt.child[0]
+                elif direction is 'r':
+                    if crt.next is None:
+                        direction = 'u'
+                        continue
+                    crt = crt.next
+                elif direction is 'u':
+                    labels[crt.parent][1] = num
+                    if crt.parent is self:
+                        break
+                    if crt.parent.next is None:
+                        crt = crt.parent
+                        continue
+                    crt = crt.parent.next
+                num += 1
+                labels[crt] = [num, num]
+                if crt.child:
+                    direction = 'd'
+                else:
+                    direction = 'r'
+        return self.order_labels_
+
+    def invalidate_order(self):
+        """HELPER-METHOD: Marks the order labels as outdated. """
+        self.order_stale_ = True
+
 
 class DocumentFragment(Document):
     """Takes in an element and "steals" its children. This element
@@ -614,8 +1052,14 @@ class DocumentFragment(Document):
         if new_child.parent is not None:
             del new_child.parent[new_child.index]
         self.child.append(new_child)
+        self.touch()
         new_child.parent = self
-        new_child.owner = self
+        if new_child.child:
+            Node.new_generation(new_child._owner)
+        new_child._stamp = -1
+        self.invalidate_names()
+        self.invalidate_classes()
+        self.invalidate_order()
         return new_child
 
     def __repr__(self):
@@ -11,6 +11,7 @@ import os
 import sys
 from cStringIO import StringIO
 LC = sys.modules['lexor.core']
+DOC_NAMES = ('#document', '#document-fragment')
 
 
 def _write_node_info(node, strf):
@@ -41,24 +42,76 @@ def _write_node_info(node, strf):
 
 def _set_owner_and_level(node, owner, level):
     """Helper method for increase_child_level. """
-    if node.owner is not owner:
-        if isinstance(node, LC.Element) and 'id' in node:
-            try:
-                del node.owner.id_dict[node['id']]
-            except (KeyError, AttributeError):
-                pass
-            if owner:
-                owner.id_dict[node['id']] = node
-        node.owner = owner
-    node.level = level
-    if node.name == '#document':
-        node.level = level - 1
+    if isinstance(node, LC.Element) and 'id' in node and owner:
+        owner.register_id(node)
+    node._owner = owner
+    if node.name in DOC_NAMES:
+        level -= 1
+    node._level = level
+    node._stamp = _generation(owner)
+
+
+def _generation(owner):
+    """Helper function which returns the generation of the nodes
+    whose owner is `owner`. """
+    if owner is None:
+        return Node.generation
+    return owner.generation_
+
+
+def _detach_children(node):
+    """`Node` helper function to remove all the child nodes of `node`
+    at once. Returns a list with the removed nodes. """
+    if not node.child:
+        return []
+    nodes = list(node.child)
+    node.remove_children()
+    return nodes
+
+
+def _resolve(node):
+    """Helper method to compute the `owner` and `level` of a node
+    whose cached values were computed before the last change in the
+    structure of the tree. Only the ancestors with outdated values
+    are visited. """
+    path = []
+    while node.parent is not None and \
+            node._stamp != _generation(node._owner):
+        path.append(node)
+        node = node.parent
+    owner = node._owner
+    level = node._level
+    generation = _generation(owner)
+    for node in reversed(path):
+        if node.name not in DOC_NAMES:
+            level += 1
+        node._owner = owner
+        node._level = level
+        node._stamp = generation
 
 
 class Node(object):
-    """Primary datatype for the entire Document Object Model. """
-    __slots__ = ('name', 'owner', 'parent', 'index',
-                 'prev', 'next', 'child', 'level')
+    """Primary datatype for the entire Document Object Model.
+
+    The `owner` and `level` of a node are not propagated to its
+    descendants when the node is moved. Instead, moving a node with
+    children increases the attribute `generation_` of the document
+    which owned it, or the class attribute `generation` if it did not
+    belong to a document, and each node whose cached owner has a
+    newer generation computes its `owner` and `level` from its parent
+    the first time they are requested. Attaching a subtree thus does
+    not visit its descendants and the nodes of other documents keep
+    their cached values.
+
+    Similarly, the `index` of the child nodes is not updated after
+    inserting or removing a child. The parent only remembers the
+    first position from which the indices may be wrong and renumbers
+    its child nodes when one of those indices is requested. """
+    __slots__ = ('name', '_owner', 'parent', '_index',
+                 'prev', 'next', 'child', '_level', '_stamp',
+                 '_reindex', '_revision')
+    generation = 0
+    revision = 1
 
     def __init__(self):
         """Initializes all data descriptors to `None`. Each
@@ -66,13 +119,51 @@ class Node(object):
         comment on each property to see what each descriptor
         represents. """
         self.name = None
-        self.owner = None
+        self._owner = None
         self.parent = None
-        self.index = None
+        self._index = None
         self.prev = None
         self.next = None
         self.child = None
-        self.level = 0
+        self._level = 0
+        self._stamp = -1
+        self._reindex = None
+        self._revision = 0
+
+    @property
+    def owner(self):
+        """The `Document` in which this node resides. If the node has
+        a parent then this value is the `owner` of the parent. """
+        if self.parent is not None and \
+                self._stamp != _generation(self._owner):
+            _resolve(self)
+        return self._owner
+
+    @owner.setter
+    def owner(self, value):
+        """Setter function for owner. This value will only persist
+        while the node has no parent. The descendants of the node
+        need to compute their owner again. """
+        if self.child:
+            Node.new_generation(self._owner)
+        self._owner = value
+
+    @property
+    def level(self):
+        """The level of containment of the node. """
+        if self.parent is not None and \
+                self._stamp != _generation(self._owner):
+            _resolve(self)
+        return self._level
+
+    @level.setter
+    def level(self, value):
+        """Setter function for level. This value will only persist
+        while the node has no parent. The descendants of the node
+        need to compute their level again. """
+        if self.child:
+            Node.new_generation(self._owner)
+        self._level = value
 
     @property
     def node_name(self):
@@ -107,16 +198,68 @@ class Node(object):
     def set_parent(self, parent, index):
         """HELPER-METHOD: Use this function to modify the parent
         node. """
+        owner = parent.owner
+        parent.touch()
         self.parent = parent
-        self.index = index
-        if self.name in ['#document', '#document-fragment']:
-            self.level = parent.level
+        self._index = index
+        if self.child:
+            # The descendants need to compute their owner and level
+            Node.new_generation(self._owner)
+        level = parent._level
+        if self.name not in DOC_NAMES:
+            level += 1
+        self._owner = owner
+        self._level = level
+        self._stamp = _generation(owner)
+        if owner is not None:
+            owner.invalidate_order()
+            if self.child:
+                owner.register_subtree(self)
+                return
+            owner.register_name(self)
+            if isinstance(self, LC.Element):
+                if 'id' in self:
+                    owner.register_id(self)
+                if 'class' in self:
+                    owner.register_class(self)
+
+    @staticmethod
+    def new_generation(owner):
+        """HELPER-METHOD: Marks the cached `owner` and `level` of the
+        nodes whose owner is `owner` as outdated. """
+        if owner is None:
+            Node.generation += 1
         else:
-            self.level = parent.level + 1
-        self.owner = parent.owner
-        if self.owner and isinstance(self, LC.Element) and 'id' in self:
-            self.owner.id_dict[self['id']] = self
-        self.increase_child_level()
+            owner.generation_ += 1
+
+    @property
+    def index(self):
+        """The position of the node in the list of child nodes of
+        its parent. """
+        parent = self.parent
+        if parent is not None and parent._reindex is not None and \
+                self._index >= parent._reindex:
+            parent._renumber()
+        return self._index
+
+    @index.setter
+    def index(self, value):
+        """Setter function for index. """
+        self._index = value
+
+    def _renumber(self):
+        """PRIVATE-METHOD: Sets the index of the child nodes which may
+        have changed since the last insertion or removal. """
+        child = self.child
+        for num in xrange(self._reindex, len(child)):
+            child[num]._index = num
+        self._reindex = None
+
+    def _invalidate_indices(self, index):
+        """PRIVATE-METHOD: Marks the indices of the child nodes from
+        position `index` as outdated. """
+        if self._reindex is None or index < self._reindex:
+            self._reindex = index
 
     @property
     def node_index(self):
@@ -209,7 +352,10 @@ class Node(object):
 
     def increase_child_level(self):
         """HELPER-METHOD: Use this function to set the level of the
-        child nodes. """
+        child nodes. This is not required after moving a node since
+        the child nodes compute their levels when requested; it only
+        saves the later computations when a whole subtree is about to
+        be traversed. """
         if self.child:
             crt = self
             direction = 'd'
@@ -243,27 +389,54 @@ class Node(object):
     def disconnect(self):
         """HELPER-METHOD: Use this function to reset the node's
         attributes. """
-        if self.owner and isinstance(self, LC.Element):
-            try:
-                del self.owner.id_dict[self['id']]
-            except (KeyError, AttributeError):
-                pass
-        self.owner = None
+        owner = self.owner
+        if self.parent is not None:
+            self.parent.touch()
+        if owner is not None:
+            owner.invalidate_order()
+            if self.child:
+                owner.unregister_subtree(self)
+            else:
+                owner.unregister_name(self)
+                if isinstance(self, LC.Element):
+                    if 'id' in self:
+                        owner.unregister_id(self)
+                    if 'class' in self:
+                        owner.unregister_class(self)
+        if self.child:
+            Node.new_generation(owner)
+        self._owner = None
         self.parent = None
-        self.index = None
+        self._index = None
         self.prev = None
         self.next = None
-        if self.name in ['#document', '#document-fragment']:
-            self.level = -1
+        if self.name in DOC_NAMES:
+            self._level = -1
         else:
-            self.level = 0
-        self.increase_child_level()
+            self._level = 0
+
+    def touch(self):
+        """Marks the node and its ancestors as modified so that a
+        `Writer` does not reuse the output it saved for them. The
+        methods which modify nodes call this method, code which
+        assigns to attributes such as `data` or `name` directly
+        should call it afterwards.
+
+        The ancestors are stamped with the current value of
+        `Node.revision`. The walk stops at the first ancestor which
+        already has it since its own ancestors have it as well. """
+        revision = Node.revision
+        crt = self
+        while crt is not None and crt._revision != revision:
+            crt._revision = revision
+            crt = crt.parent
 
     def remove_children(self):
         """Remove all the child nodes. """
         for child in self.child:
             child.disconnect()
         del self.child[:]
+        self._reindex = None
 
     def __repr__(self):
         """x.__repr__() <==> repr(x)"""
@@ -298,13 +471,17 @@ class Node(object):
         else:
             style = self.owner.style
             lang = self.owner.lang
-        writer = LC.Writer(lang, style)
+        defaults = None
         if self.owner is not None and self.owner.defaults is not None:
+            defaults = dict()
             for var, val in self.owner.defaults.iteritems():
-                writer.defaults[var] = os.path.expandvars(str(val))
-        writer.write(self)
-        val = str(writer)
-        writer.close()
+                defaults[var] = os.path.expandvars(str(val))
+        writer = LC.Writer.acquire(lang, style, defaults)
+        try:
+            writer.write(self)
+            val = str(writer)
+        finally:
+            writer.release()
         return val
 
     def insert_node_before(self, index, new_child):
@@ -313,15 +490,19 @@ class Node(object):
         this method in action."""
         if new_child.parent is not None:
             del new_child.parent[new_child.index]
+        if index < 0:
+            index = max(0, len(self.child) + index)
         self.child.insert(index, new_child)
         new_child.set_parent(self, index)
         if index > 0:
             new_child.set_prev(self.child[index-1])
+            new_child.prev.touch()
         try:
             new_child.set_next(self.child[index+1])
+            new_child.next.touch()
+            self._invalidate_indices(index)
         except IndexError:
             pass
-        self[index].index = index
         index += 1
         return index
 
@@ -333,10 +514,7 @@ class Node(object):
         elif isinstance(new_child, LC.DocumentFragment):
             msg = "Use extend_before for LC.DocumentFragment Nodes."
             raise TypeError(msg)
-        index = self.insert_node_before(index, new_child)
-        while index < len(self.child):
-            self[index].index = index
-            index += 1
+        self.insert_node_before(index, new_child)
         return self
 
     def extend_before(self, index, new_children):
@@ -349,16 +527,19 @@ class Node(object):
 
             node.extend_before(index, doc)
 
-        The second form, however, has a more efficient reindexing
-        method."""
+        The second form, however, avoids the type checks done by
+        `insert_before` and removes the nodes from `doc` all at once
+        instead of one at a time."""
         if isinstance(new_children, (list, LC.DocumentFragment)):
+            if isinstance(new_children, LC.DocumentFragment):
+                new_children = _detach_children(new_children)
             for node in new_children:
                 if node.name == '#document' and node.temporary:
                     if self.owner:
                         self.owner.meta.update(node.meta)
                         node.meta = dict()
-                    while node:
-                        index = self.insert_node_before(index, node[0])
+                    for child in _detach_children(node):
+                        index = self.insert_node_before(index, child)
                 else:
                     index = self.insert_node_before(index, node)
         else:
@@ -366,11 +547,8 @@ class Node(object):
                 if new_children.temporary and self.owner:
                     self.owner.meta.update(new_children.meta)
                     new_children.meta = dict()
-            while new_children:
-                index = self.insert_node_before(index, new_children[0])
-        while index < len(self.child):
-            self[index].index = index
-            index += 1
+            for child in _detach_children(new_children):
+                index = self.insert_node_before(index, child)
         return self
 
     def append_child_node(self, new_child):
@@ -383,6 +561,7 @@ class Node(object):
         new_child.set_parent(self, len(self.child) - 1)
         try:
             new_child.set_prev(self.child[-2])
+            new_child.prev.touch()
         except IndexError:
             pass
 
@@ -402,13 +581,15 @@ class Node(object):
         """Extend the list of children by appending children from an
         iterable containing nodes. """
         if isinstance(new_children, (list, LC.DocumentFragment)):
+            if isinstance(new_children, LC.DocumentFragment):
+                new_children = _detach_children(new_children)
             for node in new_children:
                 if node.name == '#document' and node.temporary:
                     if self.owner:
                         self.owner.meta.update(node.meta)
                         node.meta = dict()
-                    while node:
-                        self.append_child_node(node[0])
+                    for child in _detach_children(node):
+                        self.append_child_node(child)
                 else:
                     self.append_child_node(node)
         else:
@@ -416,8 +597,8 @@ class Node(object):
                 if new_children.temporary and self.owner:
                     self.owner.meta.update(new_children.meta)
                     new_children.meta = dict()
-            while new_children:
-                self.append_child_node(new_children[0])
+            for child in _detach_children(new_children):
+                self.append_child_node(child)
         return self
 
     def append_after(self, new_child):
@@ -460,6 +641,7 @@ class Node(object):
                         crt.data += marked_node.data
                         end = marked_node.index
                         marked_node = marked_node.next
+                    crt.touch()
                     crt = marked_node
                     del self[start:end+1]
                 else:
@@ -515,14 +697,16 @@ class Node(object):
             self.child[index].disconnect()
             del self.child[index]
             if index > 0:
+                self.child[index - 1].touch()
                 try:
                     self.child[index].set_prev(self.child[index - 1])
+                    self.child[index].touch()
                 except IndexError:
                     self.child[index - 1].next = None
             elif self.child:
                 self.child[index].prev = None
-        for i in xrange(index, len(self.child)):
-            self.child[i].index = i
+                self.child[index].touch()
+            self._invalidate_indices(index)
 
     def __setitem__(self, index, node):
         """Replace child nodes.
@@ -564,10 +748,12 @@ class Node(object):
             node.set_parent(self, index)
             try:
                 node.set_next(self.child[index + 1])
+                node.next.touch()
             except IndexError:
                 pass
             try:
                 node.set_prev(self.child[index - 1])
+                node.prev.touch()
             except IndexError:
                 pass
         return node
@@ -575,6 +761,9 @@ class Node(object):
     def get_nodes_by_name(self, name):
         """Return a list of Nodes contained in the Node with the
         given name. """
+        owner = self.owner
+        if owner is self and self.name_index_ is not None:
+            return list(self.name_index.get(name, ()))
         nodes = []
         if not self.child:
             return nodes
@@ -8,14 +8,53 @@ the abstract class `NodeParser`.
 
 import re
 import sys
+from bisect import bisect_left
 from lexor.command import config
 from lexor.command.lang import get_style_module, map_explanations
 LC = sys.modules['lexor.core']
+RE_NEWLINE = re.compile('\n')
 
 
 class NodeParser(object):
     """An object that has two methods: `makeNode` and `close`. The
-    first method is required to be overloaded in derived objects."""
+    first method is required to be overloaded in derived objects.
+
+    By default the parser calls `make_node` at every position of the
+    caret. If the node parser can only create a node when the caret
+    is at certain characters then declare them when deriving the
+    node parser:
+
+        triggers = '<&'
+
+    You may also provide a list of strings, in this case the parser
+    will only call `make_node` when the text at the caret starts with
+    one of the strings:
+
+        triggers = ['<!--', '<?']
+
+    To be able to parse streams with `Parser.parse_stream` without
+    reading the whole stream at once, declare the maximum number of
+    characters, starting at the caret, that `make_node` and `close`
+    need to look at:
+
+        lookahead = 256
+
+    The parser collects the strings that make up the last `Text`
+    node and joins them before calling `make_node` or `close`, which
+    copies the text collected so far on every call. If neither method
+    reads the `data` of `Text` nodes, for instance `node[-1].data` in
+    `close`, then declare
+
+        reads_text = False
+
+    so that the text is only joined when the node is closed or the
+    parsing is done and long runs of text are collected in linear
+    time.
+
+    """
+    triggers = None
+    lookahead = None
+    reads_text = True
 
     def __init__(self, parser):
         """A `NodeParser` needs to be initialized with a `Parser`
@@ -74,11 +113,139 @@ class NodeParser(object):
         msg = '%s did not implement `close`' % self.__class__
         raise NotImplementedError(msg)
 
+    @classmethod
+    def close_token(cls, _):
+        """This method gets called when the parser receives a `Node`
+        to be closed with the `close` method. Overload it to return
+        the string that must be at the caret for `close` to be able to
+        close the `Node`. The parser will then only call `close` when
+        the text at the caret starts with the string.
+
+        This method returns `None` by default so that `close` gets
+        called at every position of the caret. """
+        return None
+
     def msg(self, code, pos, arg=None, uri=None):
         """Send a message to the parser. """
         self.parser.msg(self.__module__, code, pos, arg, uri)
 
 
+def _make_dispatch_table(processors):
+    """Helper function for `Parser._set_node_parsers`. Returns a
+    dictionary mapping a character to the list of node parsers that
+    may start on that character and the list of node parsers to use
+    for any other character. Each entry in the lists is a tuple with
+    the node parser and the prefixes it declared (or `None`). The
+    order of the node parsers is preserved. """
+    table = dict()
+    default = list()
+    for processor in processors:
+        triggers = processor.triggers
+        if triggers is None:
+            for entries in table.itervalues():
+                entries.append((processor, None))
+            default.append((processor, None))
+            continue
+        if isinstance(triggers, str):
+            chars = triggers
+            prefixes = None
+        else:
+            prefixes = tuple(triggers)
+            chars = set(prefix[0] for prefix in prefixes)
+            if len(prefixes) == len(chars):
+                if all(len(prefix) == 1 for prefix in prefixes):
+                    prefixes = None
+        for char in chars:
+            if char not in table:
+                table[char] = list(default)
+            table[char].append((processor, prefixes))
+    return table, default
+
+
+def _max_lookahead(node_parsers):
+    """Helper function for `Parser._set_node_parsers`. Returns the
+    maximum lookahead declared by the node parsers or `None` if any
+    of them did not declare it. """
+    lookahead = 0
+    for processors in node_parsers:
+        for processor in processors:
+            if processor.lookahead is None:
+                return None
+            lookahead = max(lookahead, processor.lookahead)
+    return lookahead
+
+
+def _pos_to_offset(newlines, pos):
+    """Helper function for `Parser.reparse`. Returns the index in a
+    text of the position `[line, column]` given the indices of the new
+    line characters of the text. """
+    if pos[0] > 1:
+        return newlines[pos[0] - 2] + pos[1]
+    return pos[1] - 1
+
+
+def _enclosing_chain(doc, start, end, lookahead):
+    """Helper function for `Parser.reparse`. Returns the list of
+    elements, from the outermost to the innermost, whose content
+    contains the indices from `start` to `end` and which were closed
+    by their node parsers. The elements must start at least
+    `lookahead` characters before `start` so that the node parsers
+    did not look at the text being replaced before the element. """
+    chain = []
+    crt = doc
+    while crt.child:
+        for node in crt.child:
+            span = getattr(node, 'span_', None)
+            if span is None or span[1] > start:
+                continue
+            if span[2] is not None and span[2] < end:
+                continue
+            if span[3] is not None and span[0] + lookahead <= start:
+                chain.append(node)
+            crt = node
+            break
+        else:
+            break
+    return chain
+
+
+def _shift_spans(doc, skip, threshold, delta):
+    """Helper function for `Parser.reparse`. Adds `delta` to the
+    entries of the spans of the elements in `doc` which are greater
+    or equal than `threshold`. The subtree of `skip` is not
+    modified. """
+    crt = doc
+    direction = 'd'
+    while True:
+        if direction is 'd':
+            crt = crt.child[0]
+        elif direction is 'r':
+            if crt.next is None:
+                direction = 'u'
+                continue
+            crt = crt.next
+        elif direction is 'u':
+            if crt.parent is doc:
+                break
+            if crt.parent.next is None:
+                crt = crt.parent
+                continue
+            crt = crt.parent.next
+        direction = 'r'
+        if crt is skip:
+            continue
+        span = getattr(crt, 'span_', None)
+        if span is not None:
+            end = span[3]
+            for num in xrange(4):
+                if span[num] is not None and span[num] >= threshold:
+                    span[num] += delta
+            if end is not None and end < threshold:
+                continue
+        if crt.child:
+            direction = 'd'
+
+
 # The default of 7 attributes max in a class is too restrictive.
 # pylint: disable=R0902
 class Parser(object):
@@ -93,10 +260,26 @@ class Parser(object):
         self._lang = lang
         self._style = style
         self._np = None
+        self._dispatch = None
+        self._lookahead = None
+        self._stream = None
+        self._chunk_size = None
+        self._offset = 0
+        self._memo = None
         self._next_check = None
         self._in_progress = None
+        self._close_tokens = None
+        self._close_index = None
+        self._open_depths = None
         self._uri = None
         self._reload = True
+        self._lazy_pos = False
+        self._spans = False
+        self._source = None
+        self._newlines = None
+        self._newlines_text = None
+        self._text_node = None
+        self._text_chunks = None
         self.style_module = None
         self.text = None
         self.end = None
@@ -142,6 +325,10 @@ class Parser(object):
                 self._np[key] = [self._set_node_parser(p) for p in val[1]]
         for key, val in str_key:
             self._np[key] = self._np[val]
+        self._dispatch = dict()
+        for key, val in self._np.iteritems():
+            self._dispatch[key] = _make_dispatch_table(val)
+        self._lookahead = _max_lookahead(self._np.itervalues())
 
     def load_node_parsers(self):
         """Loads the node parsers. This function is called
@@ -158,24 +345,149 @@ class Parser(object):
         `document` will return a `DocumentFragment` node. """
         if self._reload:
             self.load_node_parsers()
+        if not uri:
+            uri = 'string@0x%x' % id(text)
+        self._stream = None
+        self._run(text, uri)
+
+    def parse_stream(self, fileobj, uri=None, chunk_size=65536):
+        """Parses the contents of the file object `fileobj` by reading
+        it in windows of at least `chunk_size` characters. Only the
+        text which has not been consumed along with the lookahead
+        declared by the node parsers is kept in memory. The results
+        are the same as the ones obtained by `parse`.
+
+        If one of the node parsers of the style does not declare its
+        `lookahead` or if the style module defines `pre_process`, which
+        may need to look at the whole text, then the whole stream is
+        read at once. Note that lazy positions are not used while
+        parsing streams. """
+        if self._reload:
+            self.load_node_parsers()
+        if not uri:
+            uri = 'stream@0x%x' % id(fileobj)
+        lazy_pos, spans = self._lazy_pos, self._spans
+        try:
+            self._run(self._open_stream(fileobj, chunk_size), uri)
+        finally:
+            self._lazy_pos, self._spans = lazy_pos, spans
+            self._stream = None
+
+    def iterparse(self, source, uri=None, build=None, chunk_size=65536):
+        """Generator which parses `source` and yields the tuples
+
+            ('start', node)
+            ('text', data)
+            ('end', node)
+
+        as the nodes are found. Nodes with no children yield their
+        `start` and `end` events one after the other. The strings in
+        the `text` events are the contents of the `Text` nodes that
+        `parse` would have created.
+
+        The nodes are not appended to the document. While the node
+        parsers work with a node, the `parent` attribute of the node
+        points to the node that contains it but the node is not
+        added to the list of its children. To obtain the subtree of
+        some nodes provide a collection with their names in `build`.
+        The children of those nodes will be appended to them and the
+        subtree will be complete by the time of their `end` event.
+
+        `source` may be a string or a file object, in which case it
+        is read as described in `parse_stream`. The `log` is
+        available once the generator is exhausted. """
+        if self._reload:
+            self.load_node_parsers()
+        lazy_pos, spans = self._lazy_pos, self._spans
+        if hasattr(source, 'read'):
+            if not uri:
+                uri = 'stream@0x%x' % id(source)
+            text = self._open_stream(source, chunk_size)
+        else:
+            if not uri:
+                uri = 'string@0x%x' % id(source)
+            self._stream = None
+            text = source
+        try:
+            self._begin(text, uri)
+            for event in self._iterparse(build):
+                yield event
+            self._finish()
+        finally:
+            self._lazy_pos, self._spans = lazy_pos, spans
+            self._stream = None
+
+    def _open_stream(self, fileobj, chunk_size):
+        """Prepares the parser to read from `fileobj` and returns the
+        first window of text. """
+        if self._lookahead is None or \
+                hasattr(self.style_module, 'pre_process'):
+            self._stream = None
+            return fileobj.read()
+        self._stream = fileobj
+        self._chunk_size = max(chunk_size, self._lookahead + 1)
+        self._lazy_pos = False
+        self._spans = False
+        return fileobj.read(self._chunk_size)
+
+    def _read_window(self):
+        """Drops the text before the caret and appends text from the
+        stream until the window contains more characters than the
+        lookahead of the node parsers or the stream is exhausted. """
+        window = [self.text[self.caret:]]
+        size = len(window[0])
+        while True:
+            chunk = self._stream.read(self._chunk_size)
+            if not chunk:
+                self._stream = None
+                break
+            window.append(chunk)
+            size += len(chunk)
+            if size > self._lookahead:
+                break
+        self.text = ''.join(window)
+        self.end = size
+        self._offset += self.caret
+        self.caret = 0
+        if self._memo:
+            self._memo = set(
+                key for key in self._memo if key[1] >= self._offset
+            )
+
+    def _run(self, text, uri):
+        """Helper function for `parse` and `parse_stream`. """
+        self._begin(text, uri)
+        self._parse()
+        self._finish()
+        if self._spans:
+            self.doc.source_ = self._source
+            self.doc.log_ = self.log
+
+    def _begin(self, text, uri):
+        """Resets the state of the parser before parsing `text`. """
+        self._source = text
+        self._offset = 0
+        if self._memo is not None:
+            self._memo.clear()
         self.text = text
         self.end = len(text)
         self.pos = [1, 1]
         self.caret = 0
         self.doc = LC.Document(self._lang)
-        if uri:
-            self._uri = uri
-        else:
-            self._uri = 'string@0x%x' % id(text)
+        self._uri = uri
         self.doc.uri_ = self._uri
         self.log = LC.Document("lexor", "log")
         self.log.modules = dict()
         self.log.explanation = dict()
         if hasattr(self.style_module, 'pre_process'):
             self.style_module.pre_process(self)
-        self._parse()
+
+    def _finish(self):
+        """Post processing after the text has been parsed. """
         if hasattr(self.style_module, 'post_process'):
             self.style_module.post_process(self)
+        if self._lazy_pos:
+            self._resolve_log_positions()
         map_explanations(self.log.modules, self.log.explanation)
 
     @property
@@ -196,6 +508,8 @@ class Parser(object):
         """Position of caret in the text in terms of line and column. i.e.
         returns [line, column]. You may use the attribute access `pos` if
         performance is an issue. """
+        if self._lazy_pos:
+            return self._offset_to_pos(self.caret)
         return self.pos
 
     @property
@@ -249,10 +563,305 @@ class Parser(object):
         self._style = style
         self._reload = True
 
+    def enable_lazy_pos(self):
+        """Use this to stop tracking the line and column of the caret.
+        In this mode `copy_pos` returns the index of the caret and the
+        positions stored in the log are turned into `[line, column]`
+        once the parsing is done. Only enable this mode if the node
+        parsers of the style do not modify the positions they obtain
+        from `copy_pos`. """
+        self._lazy_pos = True
+
+    def disable_lazy_pos(self):
+        """Turn off lazy positions. """
+        self._lazy_pos = False
+
+    def lazy_pos_enabled(self):
+        """Determine if lazy positions are enabled or not. """
+        return self._lazy_pos
+
+    def enable_spans(self):
+        """Use this to keep the source spans of the elements created
+        by `parse`. Every `Element` which is parsed with children gets
+        the attribute `span_`: a list with the indices in the text
+        where the node starts, where its content starts, where its
+        content ends and where the node ends. The last entry is `None`
+        if the node was not closed by its node parser. The attribute
+        `node_parser_` stores the node parser that created the node
+        and the document gets the attributes `source_` and `log_`
+        with the text that was parsed and the log. The messages in
+        the log get the attribute `caret_` with the index of the caret
+        when they were issued. These are needed by `reparse`. Spans
+        are not kept while parsing streams. """
+        self._spans = True
+
+    def disable_spans(self):
+        """Turn off source spans. """
+        self._spans = False
+
+    def spans_enabled(self):
+        """Determine if source spans are enabled or not. """
+        return self._spans
+
+    def reparse(self, doc, edit_start, edit_end, new_text):
+        """Updates `doc`, a document created by `parse` while spans
+        were enabled, after the text from `edit_start` to `edit_end`
+        in its source is replaced by `new_text`. Only the content of
+        the smallest element containing the edit is parsed again as
+        long as its node parser closes it at the same place (shifted
+        by the edit), otherwise the next enclosing element is tried.
+        The new nodes replace the children of the element, the spans
+        of the elements after the edit are shifted and the messages
+        in the log are updated. Returns the node whose children were
+        replaced, this is `doc` if the whole text had to be parsed.
+
+        The whole text is always parsed if the node parsers do not
+        declare their `lookahead` or if the style module defines
+        `pre_process`. Note that `post_process` is only called when
+        the whole text is parsed. """
+        try:
+            source = doc.source_
+            log = doc.log_
+        except AttributeError:
+            raise ValueError("the document was not parsed with spans")
+        if not 0 <= edit_start <= edit_end <= len(source):
+            raise ValueError("invalid edit: [%d, %d]" % (edit_start,
+                                                         edit_end))
+        if self._reload:
+            self.load_node_parsers()
+        text = source[:edit_start] + new_text + source[edit_end:]
+        delta = len(new_text) - edit_end + edit_start
+        chain = []
+        if self._lookahead is not None and \
+                not hasattr(self.style_module, 'pre_process'):
+            chain = _enclosing_chain(doc, edit_start, edit_end,
+                                     self._lookahead)
+        self._stream = None
+        self._uri = doc.uri_
+        self._source = text
+        self._offset = 0
+        if self._memo is not None:
+            self._memo.clear()
+        newlines = [match.start() for match in RE_NEWLINE.finditer(source)]
+        while chain:
+            node = chain.pop()
+            span = list(node.span_)
+            if self._reparse_node(node, text, delta):
+                self._update_log(log, newlines, span[1:3], delta)
+                _shift_spans(doc, node, span[3], delta)
+                break
+            # ids of the discarded nodes may have reached the document
+            doc.invalidate_ids()
+        else:
+            node = doc
+            self._reparse_document(doc, text)
+        doc.source_ = text
+        self.doc = doc
+        self.log = log
+        return node
+
+    def _reparse_node(self, node, text, delta):
+        """Helper function for `reparse`. Parses the content of `node`
+        in the new text and replaces its children if the node parser
+        of the node closes it where it is expected. Returns `True` if
+        the children were replaced. The new messages are left in the
+        `log`. """
+        ancestors = []
+        crt = node.parent
+        while crt is not None and crt.name != '#document':
+            if getattr(crt, 'node_parser_', None) is None:
+                return False
+            ancestors.append((crt, crt.node_parser_))
+            crt = crt.parent
+        start, cstart, cend, end = node.span_
+        shell = node.clone_node()
+        shell.parent = node.parent
+        shell.span_ = [start, cstart, None, None]
+        self.text = text
+        self.end = len(text)
+        self.caret = cstart
+        self.pos = self._offset_to_pos(cstart)
+        shell.pos = self._offset_to_pos(start)
+        self.log = LC.Document("lexor", "log")
+        self.log.modules = dict()
+        self.log.explanation = dict()
+        self._reset_progress()
+        self._push_progress(shell, node.node_parser_)
+        crt = shell
+        while self.caret < self.end:
+            tmp = self._close_node()
+            if tmp is not None:
+                self.flush_text()
+                if not self._in_progress:
+                    break
+                crt = tmp
+                continue
+            for ancestor, processor in ancestors:
+                if processor.reads_text:
+                    self.flush_text()
+                if processor.close(ancestor) is not None:
+                    self.flush_text()
+                    return False
+            caret = self.caret
+            new_node, processor = self._make_node(crt)
+            if new_node is None:
+                self._process_text(crt)
+            elif self._process_node(crt, new_node, processor,
+                                    caret) is new_node:
+                crt = new_node
+        self.flush_text()
+        if self._in_progress or shell.span_[2] != cend + delta or \
+                shell.span_[3] != end + delta:
+            return False
+        if self._lazy_pos:
+            self._resolve_log_positions()
+        children = shell.child
+        shell.child = list()
+        for child in children:
+            child.parent = None
+        node.remove_children()
+        node.extend_children(children)
+        node.span_ = shell.span_
+        return True
+
+    def _update_log(self, log, newlines, region, delta):
+        """Helper function for `reparse`. Removes the messages in
+        `log` located in the region of the old text that was parsed
+        again and shifts the messages after the region. The messages
+        in the parser's log are then merged with the remaining ones
+        by the index of the caret when they were issued so that the
+        log is in the order a full parse of the new text would have
+        issued them. `newlines` are the indices of the new line
+        characters in the old text. Note that the positions given in
+        the arguments of the messages are only shifted for the W100
+        messages of the parser. """
+        num = 0
+        while num < len(log):
+            msg = log[num]
+            if msg['uri'] != self._uri:
+                num += 1
+                continue
+            if msg['module'] == self.__module__ and msg['code'] == 'W100':
+                arg = msg['arg']
+                offset = _pos_to_offset(newlines, arg[1:3])
+                if offset >= region[1]:
+                    pos = self._offset_to_pos(offset + delta)
+                    msg['arg'] = (arg[0], pos[0], pos[1])
+            caret = getattr(msg, 'caret_', None)
+            if caret is not None and caret >= region[1]:
+                msg.caret_ = caret + delta
+            offset = _pos_to_offset(newlines, msg['position'])
+            if offset < region[0]:
+                num += 1
+                continue
+            if offset < region[1]:
+                del log[num]
+                continue
+            msg['position'] = self._offset_to_pos(offset + delta)
+            num += 1
+        new = list(self.log.child)
+        self.log.remove_children()
+        num = 0
+        crt = 0
+        while crt < len(new) and num < len(log):
+            msg = log[num]
+            if msg['uri'] == self._uri and \
+                    self._log_caret(new[crt]) <= self._log_caret(msg):
+                log.insert_node_before(num, new[crt])
+                crt += 1
+            num += 1
+        for msg in new[crt:]:
+            log.append_child_node(msg)
+        log.modules.update(self.log.modules)
+        map_explanations(log.modules, log.explanation)
+
+    def _log_caret(self, msg):
+        """Helper function for `_update_log`. Returns the index of
+        the caret when the message was issued, or the index of its
+        position if it was not recorded. """
+        caret = getattr(msg, 'caret_', None)
+        if caret is not None:
+            return caret
+        pos = msg['position']
+        if isinstance(pos, (int, long)):
+            return pos
+        return _pos_to_offset(self._get_newlines(), pos)
+
+    def _reparse_document(self, doc, text):
+        """Helper function for `reparse`. Parses the whole text and
+        moves the results to `doc` and its log. """
+        log = doc.log_
+        self.parse(text, doc.uri_)
+        for target, source in [(doc, self.doc), (log, self.log)]:
+            children = source.child
+            source.child = list()
+            for child in children:
+                child.parent = None
+            target.remove_children()
+            target.extend_children(children)
+        doc.meta = self.doc.meta
+        log.modules = self.log.modules
+        log.explanation = self.log.explanation
+
+    def enable_memo(self):
+        """Use this to remember the node parsers that failed to create
+        a node at a given position of the caret and context (the name
+        of the node containing the caret). The parser will not call
+        `make_node` again for them under the same circumstances. Only
+        enable this mode if the result of `make_node` depends solely
+        on the text, the caret and the context. """
+        if self._memo is None:
+            self._memo = set()
+
+    def disable_memo(self):
+        """Turn off the memoization of failed node parsers. """
+        self._memo = None
+
+    def memo_enabled(self):
+        """Determine if the memoization of failed node parsers is
+        enabled or not. """
+        return self._memo is not None
+
     def copy_pos(self):
         """Returns a copy of the current position. """
+        if self._lazy_pos:
+            return self.caret
         return list(self.pos)
 
+    def _get_newlines(self):
+        """Return a sorted list with the indices of the new line
+        characters in the text. The list is only computed again if
+        the text changes. """
+        if self._newlines_text is not self.text:
+            self._newlines = [
+                match.start() for match in RE_NEWLINE.finditer(self.text)
+            ]
+            self._newlines_text = self.text
+        return self._newlines
+
+    def _offset_to_pos(self, index):
+        """Returns the position `[line, column]` of an index in the
+        text. Unlike `compute`, the index may be less than the
+        position of the caret. """
+        nlines = bisect_left(self._get_newlines(), index)
+        if nlines > 0:
+            return [nlines + 1, index - self._newlines[nlines - 1]]
+        return [1, index + 1]
+
+    def _resolve_pos(self, pos):
+        """Return `pos` as `[line, column]` if it was given as an
+        index in the text. """
+        if isinstance(pos, (int, long)):
+            return self._offset_to_pos(pos)
+        return pos
+
+    def _resolve_log_positions(self):
+        """Turn the positions in the log which were stored as indices
+        into `[line, column]`. """
+        for node in self.log.child:
+            if isinstance(node['position'], (int, long)):
+                node['position'] = self._offset_to_pos(node['position'])
+
     def update(self, index):
         """Changes the position of the `caret` and updates `pos`.
         This function assumes that you are moving forward. Do not
@@ -260,10 +869,15 @@ class Parser(object):
         the caret. """
         if index == self.caret:
             return
-        nlines = self.text.count('\n', self.caret, index)
+        if self._lazy_pos:
+            self.caret = index
+            return
+        newlines = self._get_newlines()
+        last = bisect_left(newlines, index)
+        nlines = last - bisect_left(newlines, self.caret)
         self.pos[0] += nlines
         if nlines > 0:
-            self.pos[1] = index - self.text.rfind('\n', self.caret, index)
+            self.pos[1] = index - newlines[last - 1]
         else:
             self.pos[1] += index - self.caret
         self.caret = index
@@ -275,10 +889,14 @@ class Parser(object):
         given the index. The same applies as in update. Do not use
         compute with an index less than the current position of the
         caret. """
-        nlines = self.text.count('\n', self.caret, index)
+        if self._lazy_pos:
+            return self._offset_to_pos(index)
+        newlines = self._get_newlines()
+        last = bisect_left(newlines, index)
+        nlines = last - bisect_left(newlines, self.caret)
         tmpline = self.pos[0] + nlines
         if nlines > 0:
-            tmpcolumn = index - self.text.rfind('\n', self.caret, index)
+            tmpcolumn = index - newlines[last - 1]
         else:
             tmpcolumn = self.pos[1] + index - self.caret
         return [tmpline, tmpcolumn]
@@ -295,16 +913,26 @@ class Parser(object):
         node = LC.Void('msg')
         node['module'] = mod_name
         node['code'] = code
-        node['position'] = list(pos)
+        if isinstance(pos, (int, long)):
+            node['position'] = pos
+        else:
+            node['position'] = list(pos)
         node['uri'] = uri
         node['arg'] = arg
+        if self._spans:
+            node.caret_ = self._offset + self.caret
         if mod_name not in self.log.modules:
             self.log.modules[mod_name] = sys.modules[mod_name]
         self.log.append_child(node)
 
-    def _get_np(self, node):
-        """Get a node parser based on the name of the node. """
-        return self._np.get(node.name, self._np['__default__'])
+    def _get_candidates(self, node):
+        """Get the node parsers, along with the prefixes they declared,
+        that may create a node at the current position of the caret
+        based on the name of the node. """
+        table, default = self._dispatch.get(
+            node.name, self._dispatch['__default__']
+        )
+        return table.get(self.text[self.caret], default)
 
     def _get_next_checker(self, node):
         """Get the checker based on the name of the node. """
@@ -318,52 +946,169 @@ class Parser(object):
             return -1
         return match.end(0)-1
 
-    def _process_node(self, crt, node, processor):
-        """Appends the node to crt. """
+    def flush_text(self):
+        """The parser collects the strings that make up the last
+        `Text` node it appended and joins them when the node is
+        closed or when the parsing is done. Node parsers declaring
+        `reads_text = False` which still need to inspect the `data`
+        of the last `Text` node on some calls should call this method
+        first. """
+        if self._text_node is not None:
+            self._text_node.data = ''.join(self._text_chunks)
+            self._text_node.touch()
+            self._text_node = None
+            self._text_chunks = None
+
+    def _append_text(self, crt, text):
+        """Appends `text` to the last child of crt if it is a `Text`
+        node, otherwise it appends `text` as a new child. `text` may
+        be a `Text` node or a string. """
+        if isinstance(text, LC.Text):
+            data = text.data
+        else:
+            data = text
+        if self._text_node is not None and crt.child and \
+                crt.child[-1] is self._text_node:
+            self._text_chunks.append(data)
+            return
+        self.flush_text()
+        if len(crt) > 0 and isinstance(crt[-1], LC.Text):
+            self._text_chunks = [crt[-1].data, data]
+        else:
+            if not isinstance(text, LC.Text):
+                text = LC.Text(text)
+            LC.TreeBuilder.attach(crt, text)
+            self._text_chunks = [data]
+        self._text_node = crt[-1]
+
+    def _process_node(self, crt, node, processor, start=None):
+        """Appends the node to crt. `start` is the index where the
+        node parser started to create the node. """
         if isinstance(node, LC.Text):
-            if len(crt) > 0 and isinstance(crt[-1], LC.Text):
-                crt[-1].data += node.data
-            else:
-                crt.append_child(node)
-        elif isinstance(node, list):  # Empty Element
-            crt.append_child(node[0])
+            self._append_text(crt, node)
+            return None
+        self.flush_text()
+        if isinstance(node, list):  # Empty Element
+            LC.TreeBuilder.attach(crt, node[0])
         else:
-            crt.append_child(node)
+            LC.TreeBuilder.attach(crt, node)
             if isinstance(node.child, list):
-                self._in_progress.append((node, processor))
+                if self._spans:
+                    node.span_ = [start, self.caret, None, None]
+                    node.node_parser_ = processor
+                self._push_progress(node, processor)
                 return node
         return None
 
-    def _process_text(self, crt):
-        """When there is no node then we just read the text. """
+    def _read_text(self, crt):
+        """When there is no node then we just read the text. Returns
+        the text that was read. """
         index = self._get_next_check(crt)
         if index == -1:
             content = self.text[self.caret:self.end]
-            if len(crt) > 0 and isinstance(crt[-1], LC.Text):
-                crt[-1].data += content
-            else:
-                crt.append_child(content)
             self.update(self.end)
-            return
+            return content
         elif index - self.caret == 0:
             index += 1
         content = self.text[self.caret:index]
         self.update(index)
-        if len(crt) > 0 and isinstance(crt[-1], LC.Text):
-            crt[-1].data += content
+        return content
+
+    def _process_text(self, crt):
+        """Appends the text that was read to crt. """
+        self._append_text(crt, self._read_text(crt))
+
+    def _make_node(self, crt):
+        """Returns the node created by the first node parser which
+        is able to create a node at the current position along with
+        the node parser. If there is no such node parser then the
+        node is `None`. """
+        memo = self._memo
+        for processor, prefixes in self._get_candidates(crt):
+            if prefixes and not self.text.startswith(prefixes,
+                                                     self.caret):
+                continue
+            if memo is not None:
+                key = (processor, self._offset + self.caret, crt.name)
+                if key in memo:
+                    continue
+            if processor.reads_text:
+                self.flush_text()
+            node = processor.make_node()
+            if node is not None:
+                return node, processor
+            elif self.caret == self.end:
+                break
+            elif memo is not None and key[1] == self._offset + self.caret:
+                memo.add(key)
+        return None, None
+
+    def _reset_progress(self):
+        """Empties the list of nodes in progress. """
+        self._in_progress = []
+        self._close_tokens = []
+        self._close_index = dict()
+        self._open_depths = []
+
+    def _push_progress(self, node, processor):
+        """Appends a node to the list of nodes in progress. The depth
+        of the node is indexed by the first character of the closing
+        token published by the node parser. """
+        token = processor.close_token(node)
+        depth = len(self._in_progress)
+        self._in_progress.append((node, processor))
+        self._close_tokens.append(token)
+        if token:
+            index = self._close_index.setdefault(token[0], dict())
+            index.setdefault(token, []).append(depth)
         else:
-            crt.append_child(content)
+            self._open_depths.append(depth)
+
+    def _pop_progress(self):
+        """Removes the last node in the list of nodes in progress. """
+        depth = len(self._in_progress) - 1
+        del self._in_progress[depth]
+        token = self._close_tokens.pop()
+        if token:
+            index = self._close_index[token[0]]
+            index[token].pop()
+            if not index[token]:
+                del index[token]
+                if not index:
+                    del self._close_index[token[0]]
+        else:
+            self._open_depths.pop()
+
+    def _close_candidates(self):
+        """Returns the depths of the nodes in progress whose node
+        parsers may close them at the current position, from the
+        innermost to the outermost. """
+        index = self._close_index.get(self.text[self.caret])
+        if index is None:
+            return reversed(self._open_depths)
+        depths = list(self._open_depths)
+        for token, token_depths in index.iteritems():
+            if self.text.startswith(token, self.caret):
+                depths.extend(token_depths)
+        depths.sort(reverse=True)
+        return depths
 
     def _close_node(self):
         """Checks and closes a node that is in self._in_progress. """
-        num = len(self._in_progress)
+        caret = self.caret
+        num = None
         autoclose = None
-        for node, processor in reversed(self._in_progress):
-            num -= 1
+        for num in self._close_candidates():
+            node, processor = self._in_progress[num]
+            if processor.reads_text:
+                self.flush_text()
             autoclose = processor.close(node)
             if autoclose is not None:
                 break
         if autoclose is not None:
+            if self._spans:
+                self._close_spans(num, caret)
+            autoclose = self._resolve_pos(autoclose)
             # Must go backwards since the list inprogress is
             # changing.
             for i in xrange(len(self._in_progress)-1, num, -1):
@@ -374,40 +1119,132 @@ class Parser(object):
                     (name, autoclose[0], autoclose[1])
                 )
                 del self._in_progress[i][0].pos
-                del self._in_progress[i]
-            del self._in_progress[num]
+                self._pop_progress()
+            self._pop_progress()
             if self._in_progress:
                 return self._in_progress[-1][0]
             else:
                 return self.doc
         return None
 
+    def _close_spans(self, num, caret):
+        """Records the end of the content of the nodes in progress
+        starting at index `num`. `caret` is the index where the
+        content ended. Only the first node was closed by its node
+        parser. """
+        for node, _ in self._in_progress[num:]:
+            if hasattr(node, 'span_'):
+                node.span_[2] = caret
+        node = self._in_progress[num][0]
+        if hasattr(node, 'span_'):
+            node.span_[3] = self.caret
+
     def _parse(self):
         """Main parsing function. This function depends on the
         node parsers of the language. """
         crt = self.doc
-        self._in_progress = []
-        while self.caret < self.end:
+        self._reset_progress()
+        while True:
+            if self._stream is not None and \
+                    self.end - self.caret <= self._lookahead:
+                self._read_window()
+            if self.caret >= self.end:
+                break
             tmp = self._close_node()
             if tmp is not None:
+                self.flush_text()
                 crt = tmp
                 continue
-            match = False
-            processor = None
-            for processor in self._get_np(crt):
-                node = processor.make_node()
-                if node is not None:
-                    match = True
-                    break
-                elif self.caret == self.end:
-                    break
-            if match is False:
+            caret = self.caret
+            node, processor = self._make_node(crt)
+            if node is None:
                 self._process_text(crt)
-            elif self._process_node(crt, node, processor) is node:
+            elif self._process_node(crt, node, processor,
+                                    caret) is node:
                 crt = node
+        self.flush_text()
+        for node, processor in self._in_progress:
+            self.msg(self.__module__, 'E100', node.pos, [node.name])
+            del node.pos
+
+    def _skip_indexes(self):
+        """HELPER-METHOD: Marks the indexes of the document as
+        outdated so that the nodes appended to the subtrees built by
+        `iterparse`, which cannot be reached from the document, are
+        not registered in them. """
+        doc = self.doc
+        doc.invalidate_ids()
+        doc.invalidate_names()
+        doc.invalidate_classes()
+
+    # pylint: disable=R0912
+    def _iterparse(self, build):
+        """Parsing function for `iterparse`. Mirrors `_parse` but only
+        links the nodes inside the subtrees requested in `build`. """
+        crt = self.doc
+        linked = False
+        stack = []
+        texts = []
+        self._reset_progress()
+        while True:
+            if self._stream is not None and \
+                    self.end - self.caret <= self._lookahead:
+                self._read_window()
+            if self.caret >= self.end:
+                break
+            tmp = self._close_node()
+            if tmp is not None:
+                self.flush_text()
+                if texts:
+                    yield 'text', ''.join(texts)
+                    texts = []
+                while len(stack) > len(self._in_progress):
+                    yield 'end', stack.pop()[0]
+                crt = tmp
+                linked = stack[-1][1] if stack else False
+                continue
+            node, processor = self._make_node(crt)
+            if node is None:
+                node = self._read_text(crt)
+            if isinstance(node, (basestring, LC.Text)):
+                if linked:
+                    self._skip_indexes()
+                    self._append_text(crt, node)
+                if isinstance(node, basestring):
+                    texts.append(node)
+                else:
+                    texts.append(node.data)
+                continue
+            self.flush_text()
+            if texts:
+                yield 'text', ''.join(texts)
+                texts = []
+            if isinstance(node, list):  # Empty Element
+                node = node[0]
+                in_progress = False
+            else:
+                in_progress = isinstance(node.child, list)
+            if linked:
+                self._skip_indexes()
+                LC.TreeBuilder.attach(crt, node)
+            else:
+                node.parent = crt
+            yield 'start', node
+            if not in_progress:
+                yield 'end', node
+                continue
+            self._push_progress(node, processor)
+            linked = linked or (build is not None and node.name in build)
+            stack.append((node, linked))
+            crt = node
+        self.flush_text()
+        if texts:
+            yield 'text', ''.join(texts)
         for node, processor in self._in_progress:
             self.msg(self.__module__, 'E100', node.pos, [node.name])
             del node.pos
+        while stack:
+            yield 'end', stack.pop()[0]
 
 
 MSG = {
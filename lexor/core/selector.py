@@ -16,6 +16,9 @@ import types
 from datetime import datetime
 from time import mktime
 from pprint import pprint
+from collections import OrderedDict
+from lexor.core.node import DOC_NAMES
+from lexor.core.elements import sort_in_tree_order
 LC = sys.modules['lexor.core']
 
 
@@ -25,6 +28,92 @@ def get_date():
     return int(mktime(date.timetuple()))
 
 
+class LRUCache(object):
+    """A dictionary which holds at most `capacity` items. When it is
+    full, storing a new item discards the least recently used one.
+    The number of lookups that found (`hits`) or did not find
+    (`misses`) the requested key are recorded. """
+
+    def __init__(self, capacity):
+        self._data = OrderedDict()
+        self._capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def capacity(self):
+        """The maximum number of items in the cache. """
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, value):
+        """Setter function for capacity. """
+        self._capacity = value
+        while len(self._data) > value:
+            self._data.popitem(last=False)
+
+    def __getitem__(self, key):
+        """Return the value and mark it as the most recently used.
+
+            x.__getitem__(key) <==> x[key]
+
+        """
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        """x.__setitem__(key, value) <==> x[key] = value"""
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self._capacity:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        """x.__contains__(key) <==> key in x"""
+        return key in self._data
+
+    def __len__(self):
+        """x.__len__() <==> len(x)"""
+        return len(self._data)
+
+    def clear(self):
+        """Remove all the items and reset the counters. """
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Return a dictionary with the hits, misses, size and
+        capacity of the cache. """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'capacity': self._capacity,
+        }
+
+
+def cache_info():
+    """Return the information of the caches used by the selectors:
+    `tokenize`, `compile_selector` and `filter_class`. The capacity
+    of each cache can be modified, for instance:
+
+        tokenize.cache.capacity = 1024
+
+    """
+    return {
+        'tokenize': tokenize.cache.info(),
+        'compile_selector': compile_selector.cache.info(),
+        'filter_class': _filter_class.cache.info(),
+    }
+
+
 def mark_function(fnc):
     """Mark a function for special use by Sizzle. """
     fnc.expando = True
@@ -78,50 +167,208 @@ RQUICKEXPR = re.compile(r'^(?:#([\w-]+)|(\w+)|\.([\w-]+))$')
 RUNESCAPE = re.compile("\\\\([\\da-f]{1,6}" + WHITESPACE + "?|(" +
                        WHITESPACE + ")|.)", re.IGNORECASE)
 EXPANDO = 'sizzle'+str(get_date())
+RWHITESPACE = re.compile(WHITESPACE + "+")
+RNTH = re.compile(r'^(?:([+-]?\d*)n([+-]\d+)?|([+-]?\d+))$')
+RHEADER = re.compile(r'^h\d$', re.IGNORECASE)
+INPUT_ELEMENTS = ('input', 'select', 'textarea', 'button')
+FORM_ELEMENTS = INPUT_ELEMENTS + ('option', 'optgroup', 'fieldset')
+NON_TEXT = (LC.Comment, LC.ProcessingInstruction, LC.DocumentType)
 
 
 def _pre_filter_attr(match):
-    """function for EXPR['pre_filter']['ATTR']"""
-    #match[0] = match[0].replace(runescape, funescape);
-    #match[0] = re.sub(runescape, funescape, match[0])
+    """function for EXPR['pre_filter']['ATTR']. Returns the matched
+    string, the name of the attribute, the operator and the value to
+    compare. """
     # Move the given value to match[3] whether quoted or unquoted
-    match[2] = match[3] or match[4] or ""
-    #match[2] = match[2].replace(runescape, funescape);
-    if match[1] == "~=":
-        match[2] = " " + match[2] + " "
+    match[3] = match[4] or match[5] or ""
+    if match[2] == "~=":
+        match[3] = " " + match[3] + " "
     return match[:4]
 
 
+def _parse_nth(argument):
+    """Returns the integers `a` and `b` of an argument of the form
+    `an+b`, `even` or `odd`. """
+    argument = RWHITESPACE.sub('', argument).lower()
+    if argument == 'even':
+        return 2, 0
+    if argument == 'odd':
+        return 2, 1
+    match = RNTH.match(argument)
+    if match is None:
+        raise ValueError("invalid nth argument: %r" % argument)
+    a_str, b_str, only_b = match.groups()
+    if only_b is not None:
+        return 0, int(only_b)
+    if a_str in ('', '+'):
+        a_val = 1
+    elif a_str == '-':
+        a_val = -1
+    else:
+        a_val = int(a_str)
+    return a_val, int(b_str or 0)
+
+
 def _pre_filter_child(match):
-    """function for EXPR['pre_filter']['CHILD']"""
-    match[0] = match[0].lower()
-    if match[0].slice[:3] == "nth":
+    """function for EXPR['pre_filter']['CHILD']. Returns the matched
+    string, the position (only, first, last, nth or nth-last), the
+    type (child or of-type) and the integers `a` and `b`. """
+    what = match[1].lower()
+    if what[:3] == "nth":
         # nth-* requires argument
-        if not match[2]:
-            print 'ERROR'
-            sys.exit(2)
-            # Should raise an error showing match[0]
-        # numeric x and y parameters for Expr.filter.CHILD
-        # remember that false/true cast respectively to 0/1
-        # ML: Possible +=
-        if match[4]:
-            match[4] = match[5] + (match[6] or 1)
-        else:
-            match[4] = 2*(match[3] == "even" or match[3] == "odd")
-        match[5] = ((match[7] + match[8]) or match[3] == "odd")
-    #other types prohibit arguments
+        if not match[3]:
+            raise ValueError("%s requires an argument" % match[0])
+        a_val, b_val = _parse_nth(match[3])
     elif match[3]:
-        print 'ERROR'
-        sys.exit(2)
-    return match
+        # other types prohibit arguments
+        raise ValueError("%s does not take arguments" % match[0])
+    else:
+        a_val, b_val = 0, 0
+    return [match[0], what, match[2].lower(), a_val, b_val]
+
+
+def _closing_paren(text, index):
+    """Returns the index of the parenthesis closing the one before
+    `index` in `text` or -1 if it is not closed. """
+    depth = 1
+    quote = None
+    while index < len(text):
+        char = text[index]
+        if char == '\\':
+            index += 2
+            continue
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return index
+        index += 1
+    return -1
+
+
+def _pre_filter_pseudo(match):
+    """function for EXPR['pre_filter']['PSEUDO']. Returns the matched
+    string, the name of the pseudo-class and its argument. Returns
+    None for the structural pseudo-classes so that the next pass of
+    `tokenize` matches them as CHILD tokens. """
+    if MATCH_EXPR['CHILD'].match(match[0]):
+        return None
+    if match[3]:
+        # quoted argument
+        argument = match[4]
+    elif match[2] is not None:
+        start = len(match[1]) + 2
+        end = _closing_paren(match[0], start)
+        if end == -1:
+            raise ValueError("unbalanced parenthesis in %r" % match[0])
+        argument = match[0][start:end]
+        match[0] = match[0][:end+1]
+    else:
+        argument = None
+    return [match[0], match[1].lower(), argument]
+
+
+def _is_element(node):
+    """Return True if the node may be selected. """
+    return isinstance(node, LC.Element) and node.name not in DOC_NAMES
+
+
+def _parent_element(node):
+    """Return the closest ancestor which may be selected. """
+    node = node.parent
+    while node is not None and node.name in DOC_NAMES:
+        node = node.parent
+    return node
+
+
+def _sibling_element(node, direction):
+    """Return the closest sibling which may be selected in the
+    direction 'prev' or 'next'. """
+    node = getattr(node, direction)
+    while node is not None and not _is_element(node):
+        node = getattr(node, direction)
+    return node
+
+
+def _get_elements(context):
+    """Return a list with the descendants of context which may be
+    selected. """
+    nodes = []
+    if not context.child:
+        return nodes
+    crt = context
+    direction = 'd'
+    while True:
+        if direction is 'd':
+            crt = crt.child[0]
+        elif direction is 'r':
+            if crt.next is None:
+                direction = 'u'
+                continue
+            crt = crt.next
+        elif direction is 'u':
+            if crt.parent is context:
+                break
+            if crt.parent.next is None:
+                crt = crt.parent
+                continue
+            crt = crt.parent.next
+        if _is_element(crt):
+            nodes.append(crt)
+        if crt.child:
+            direction = 'd'
+        else:
+            direction = 'r'
+    return nodes
+
+
+def _text_content(node):
+    """Return the text contained in the node. """
+    text = []
+    if not node.child:
+        return ''
+    crt = node
+    direction = 'd'
+    while True:
+        if direction is 'd':
+            crt = crt.child[0]
+        elif direction is 'r':
+            if crt.next is None:
+                direction = 'u'
+                continue
+            crt = crt.next
+        elif direction is 'u':
+            if crt.parent is node:
+                break
+            if crt.parent.next is None:
+                crt = crt.parent
+                continue
+            crt = crt.parent.next
+        if isinstance(crt, LC.CharacterData) and \
+                not isinstance(crt, NON_TEXT):
+            text.append(crt.data)
+        if crt.child:
+            direction = 'd'
+        else:
+            direction = 'r'
+    return ''.join(text)
 
 
 def _filter_tag(node_name_selector):
+    """Returns a function that checks the name of an element. The
+    names are compared exactly, as `get_nodes_by_name` does, so that
+    `P` and `p` select different elements. """
     name = node_name_selector
     if node_name_selector == '*':
-        return lambda: True
+        return lambda elem: True
     else:
-        return lambda elem: elem and elem.name.lower() == name
+        return lambda elem: elem.name == name
 
 
 def _filter_class(class_name):
@@ -131,9 +378,147 @@ def _filter_class(class_name):
     except KeyError:
         pass
     pattern = re.compile("(^|" + WHITESPACE + ")" + class_name + "(" + WHITESPACE + "|$)")
-    _filter_class.cache[class_name] = lambda elem: pattern.search(elem['class']) if 'class' in elem else None
-    return _filter_class.cache[class_name]
-_filter_class.cache = dict()
+    fnc = lambda elem: pattern.search(elem['class']) if 'class' in elem else None
+    _filter_class.cache[class_name] = fnc
+    return fnc
+if not hasattr(_filter_class, 'cache'):
+    _filter_class.cache = LRUCache(512)
+
+
+def _filter_id(element_id):
+    return lambda elem: 'id' in elem and elem['id'] == element_id
+
+
+def _attr_value(value):
+    """Return the attribute value as a string. Values which are
+    already strings, including unicode ones, are returned as they
+    are. """
+    if isinstance(value, basestring):
+        return value
+    return str(value)
+
+
+def _filter_attr(name, operator, check):
+    """Returns a function which checks the value of the attribute
+    `name` according to `operator`. """
+    def match(elem):
+        """Compare the attribute. """
+        if name not in elem:
+            return operator == "!="
+        if not operator:
+            return True
+        result = _attr_value(elem[name])
+        if operator == "=":
+            return result == check
+        if operator == "!=":
+            return result != check
+        if operator == "^=":
+            return bool(check) and result.startswith(check)
+        if operator == "*=":
+            return bool(check) and check in result
+        if operator == "$=":
+            return bool(check) and result.endswith(check)
+        if operator == "~=":
+            return check in " " + RWHITESPACE.sub(" ", result) + " "
+        if operator == "|=":
+            return result == check or result.startswith(check + "-")
+        return False
+    return match
+
+
+def _nth(position, a_val, b_val):
+    """Return True if there is an integer n >= 0 such that
+    a*n + b is equal to position. """
+    diff = position - b_val
+    if a_val == 0:
+        return diff == 0
+    return diff % a_val == 0 and diff // a_val >= 0
+
+
+def _filter_child(what, ftype, a_val, b_val):
+    """Returns a function which checks the position of an element
+    among its siblings. """
+    of_type = ftype == 'of-type'
+
+    def count(elem, direction):
+        """Number of element siblings in the direction. """
+        num = 0
+        node = _sibling_element(elem, direction)
+        while node is not None:
+            if not of_type or node.name == elem.name:
+                num += 1
+            node = _sibling_element(node, direction)
+        return num
+
+    def first(elem, direction):
+        """True if there are no siblings in the direction. """
+        node = _sibling_element(elem, direction)
+        while node is not None:
+            if not of_type or node.name == elem.name:
+                return False
+            node = _sibling_element(node, direction)
+        return True
+
+    if what == 'first':
+        return lambda elem: first(elem, 'prev')
+    if what == 'last':
+        return lambda elem: first(elem, 'next')
+    if what == 'only':
+        return lambda elem: first(elem, 'prev') and first(elem, 'next')
+    if what == 'nth':
+        return lambda elem: _nth(count(elem, 'prev') + 1, a_val, b_val)
+    return lambda elem: _nth(count(elem, 'next') + 1, a_val, b_val)
+
+
+def _is_empty(elem):
+    """True if the element has no children other than comments and
+    processing instructions. """
+    for node in elem.child or ():
+        if not isinstance(node, NON_TEXT):
+            return False
+    return True
+
+
+def _filter_lang(lang):
+    """Returns a function to check the language of an element. """
+    lang = lang.lower()
+
+    def match(elem):
+        """Find the closest lang attribute. """
+        while elem is not None:
+            if 'lang' in elem:
+                value = _attr_value(elem['lang']).lower()
+                return value == lang or value.startswith(lang + '-')
+            elem = _parent_element(elem)
+        return False
+    return match
+
+
+def _filter_pseudo(name, argument):
+    """Returns a function which checks a pseudo-class. """
+    if name in ('not', 'has', 'contains', 'lang') and argument is None:
+        raise ValueError(":%s requires an argument" % name)
+    if name == 'not':
+        matchers = [matcher_from_tokens(tokens)
+                    for tokens in tokenize(argument.strip())]
+        return lambda elem: not any(fnc(elem, None) for fnc in matchers)
+    if name == 'has':
+        compiled = compile_selector(argument.strip())
+        return lambda elem: bool(compiled(None, elem, []))
+    if name == 'contains':
+        return lambda elem: argument in _text_content(elem)
+    if name == 'lang':
+        return _filter_lang(argument)
+    if name in SIMPLE_PSEUDOS:
+        return SIMPLE_PSEUDOS[name]
+    raise ValueError("unsupported pseudo-class :%s" % name)
+
+
+def _filter_input(input_type):
+    """Returns a function to check the type of an input element. """
+    return lambda elem: elem.name == 'input' and \
+        _attr_value(elem.get('type')).lower() == input_type
+
 
 EXPR = {
     'create_pseudo': mark_function,
@@ -141,20 +526,46 @@ EXPR = {
     'attr_handle': {},
     'find': {},
     'relative': {
-        '>': {'dir': "parent_node", 'first': True},
-        ' ': {'dir': "parent_node"},
-        '+': {'dir': "previous_sibling", 'first': True},
-        '~': {'dir': "previous_sibling"}
+        '>': {'dir': "parent", 'first': True},
+        ' ': {'dir': "parent"},
+        '+': {'dir': "prev", 'first': True},
+        '~': {'dir': "prev"}
     },
     'pre_filter': {
         'ATTR': _pre_filter_attr,
         'CHILD': _pre_filter_child,
+        'PSEUDO': _pre_filter_pseudo,
     },
     'filter': {
         'TAG': _filter_tag,
         'CLASS': _filter_class,
+        'ID': _filter_id,
+        'ATTR': _filter_attr,
+        'CHILD': _filter_child,
+        'PSEUDO': _filter_pseudo,
     }
 }
+# The order in which the filters are tried by `tokenize`
+FILTER_ORDER = ('TAG', 'CLASS', 'ATTR', 'CHILD', 'PSEUDO', 'ID')
+SIMPLE_PSEUDOS = {
+    'root': lambda elem: _parent_element(elem) is None,
+    'empty': _is_empty,
+    'parent': lambda elem: not _is_empty(elem),
+    'header': lambda elem: RHEADER.match(elem.name) is not None,
+    'input': lambda elem: elem.name in INPUT_ELEMENTS,
+    'button': lambda elem: elem.name == 'button' or
+    _filter_input('button')(elem),
+    'checked': lambda elem: 'checked' in elem or
+    elem.name == 'option' and 'selected' in elem,
+    'selected': lambda elem: 'selected' in elem,
+    'disabled': lambda elem: 'disabled' in elem,
+    'enabled': lambda elem: elem.name in FORM_ELEMENTS and
+    'disabled' not in elem,
+}
+for _type in ('radio', 'checkbox', 'file', 'password', 'image',
+              'submit', 'reset', 'text'):
+    SIMPLE_PSEUDOS[_type] = _filter_input(_type)
+
 
 def clone_obj(obj, parser):
     """Utility function to create deep copies of objects used for the
@@ -201,57 +612,217 @@ def sizzle(selector, context, results=None, seed=None):
 
 
 def select(selector, context, results, seed):
-    """ A low-level selection function that works with Sizzle's
-    compiled selector functions
-
-    @param {String|Function} selector A selector or a pre-compiled
-     selector function built with Sizzle.compile
-    @param {Element} context
-    @param {Array} [results]
-    @param {Array} [seed] A set of elements to match against
-    """
-    #compiled = typeof selector === "function" && selector
-    #selector = compiled.selector or selector
-    match = not seed and tokenize(selector)
-    results = results or list()
-    if len(match) == 1:
-        # Other complicated stuff
-        pass
-    compile_selector(selector, match)(seed, context, results)
+    """ A low-level selection function that works with the compiled
+    selector functions. `seed` is an optional list of elements to
+    match against. """
+    compile_selector(selector)(seed, context, results)
     return results
 
 
+def _matches_context(elem, context):
+    """Base matcher for selectors starting with a combinator. """
+    return elem is context
+
+
+def _add_combinator(matcher, combinator):
+    """Returns a function which checks if the elements related to an
+    element through `combinator` match `matcher`. """
+    relative = EXPR['relative'][combinator]
+    direction = relative['dir']
+    if relative.get('first'):
+        if direction == 'parent':
+            def match(elem, context):
+                """Check the parent. """
+                elem = _parent_element(elem)
+                return elem is not None and matcher(elem, context)
+        else:
+            def match(elem, context):
+                """Check the previous sibling. """
+                elem = _sibling_element(elem, direction)
+                return elem is not None and matcher(elem, context)
+        return match
+    if direction == 'parent':
+        step = _parent_element
+    else:
+        step = lambda node: _sibling_element(node, direction)
+
+    def match_any(elem, context):
+        """Check all the nodes in the direction. """
+        elem = step(elem)
+        while elem is not None:
+            if matcher(elem, context):
+                return True
+            elem = step(elem)
+        return False
+    return match_any
+
+
+def _compound_matcher(filters, relative):
+    """Returns a function which checks the filters of a compound
+    selector from right to left and then the relative matcher. """
+    filters = filters[::-1]
+    if relative is None:
+        def match(elem, _):
+            """Check the filters. """
+            for fnc in filters:
+                if not fnc(elem):
+                    return False
+            return True
+    else:
+        def match(elem, context):
+            """Check the filters and the relative matcher. """
+            for fnc in filters:
+                if not fnc(elem):
+                    return False
+            return relative(elem, context)
+    return match
+
+
+def _find_by_id(context, element_id):
+    """Return the elements in context with the given id. """
+    owner = context.owner
+    if owner is None:
+        return [elem for elem in _get_elements(context)
+                if 'id' in elem and elem['id'] == element_id]
+    elem = owner.get_element_by_id(element_id)
+    if elem is None or elem is context:
+        return []
+    if owner is context or context.contains(elem):
+        return [elem]
+    return []
+
+
+def _compound_kinds(tokens):
+    """Returns a dictionary mapping the token types in the last
+    compound selector in `tokens` to the first of their matches. The
+    universal selector is not included. """
+    kinds = dict()
+    for token in reversed(tokens):
+        if token['type'] in EXPR['relative']:
+            break
+        kinds[token['type']] = token['matches'][0]
+    if kinds.get('TAG') == '*':
+        del kinds['TAG']
+    return kinds
+
+
+def _candidate_finder(tokens):
+    """Returns a function which gives a list in tree order of the
+    elements in a context which could match the last compound
+    selector in `tokens`. The id, class and tag of the compound are
+    used, in that order, to reduce the list. """
+    kinds = _compound_kinds(tokens)
+    if 'ID' in kinds:
+        return lambda context: _find_by_id(context, kinds['ID'])
+    tag = kinds.get('TAG')
+    if 'CLASS' in kinds:
+        class_name = kinds['CLASS']
+
+        def find(context):
+            """Use the class index if possible. """
+            if tag is None or context.owner is context and \
+                    context.class_index_enabled():
+                return context.get_elements_by_class_name(class_name)
+            return context.get_nodes_by_name(tag)
+        return find
+    if tag is not None:
+        return lambda context: context.get_nodes_by_name(tag)
+    return _get_elements
+
+
 def matcher_from_tokens(tokens):
-    pass
+    """Returns a function which takes an element and a context and
+    returns True if the element matches the selector described by
+    `tokens`. The selector is checked from right to left. """
+    if not tokens or tokens[-1]['type'] in EXPR['relative']:
+        raise ValueError("selector may not end with a combinator")
+    filters = list()
+    relative = None
+    for token in tokens:
+        ttype = token['type']
+        if ttype in EXPR['relative']:
+            if filters or relative is not None:
+                left = _compound_matcher(filters, relative)
+            else:
+                left = _matches_context
+            relative = _add_combinator(left, ttype)
+            filters = list()
+        else:
+            filters.append(EXPR['filter'][ttype](*token['matches']))
+    return _compound_matcher(filters, relative)
+
+
+def matcher_from_group_matchers(group_matchers):
+    """Returns a function which takes a seed, a context and a list
+    of results. The elements in seed, or the descendants of context
+    if seed is None, matching any of the groups are appended to the
+    results in tree order. Each group is described by a tuple with
+    its candidate finder, its matcher and a flag stating if it
+    starts with a sibling combinator. """
+    def super_matcher(seed, context, results):
+        """Select the elements. """
+        found = list()
+        for finder, matcher, siblings in group_matchers:
+            if seed is not None:
+                candidates = seed
+            elif siblings:
+                if context.parent is None:
+                    continue
+                candidates = finder(context.parent)
+            else:
+                candidates = finder(context)
+            for elem in candidates:
+                if _is_element(elem) and matcher(elem, context):
+                    found.append(elem)
+        if len(group_matchers) > 1:
+            unique = dict()
+            for elem in found:
+                unique[id(elem)] = elem
+            found = sort_in_tree_order(unique.values())
+        results.extend(found)
+        return results
+    return super_matcher
 
-def matcher_from_group_matchers(element_matchers, set_matchers):
-    pass
 
 def compile_selector(selector, match=None):
+    """Returns a function that applies the selector. See
+    `matcher_from_group_matchers`. The attribute `groups` of the
+    function holds a tuple for each group in the selector with the
+    tag name required by the group (or None), its matcher and a flag
+    stating if it starts with a sibling combinator.
+
+    Tag names in the selector are case-sensitive: they must match the
+    `name` of the elements exactly. """
     try:
         return compile_selector.cache[selector]
     except KeyError:
         pass
-    set_matchers = list()
-    element_matchers = list()
     if match is None:
         match = tokenize(selector)
-    i = len(match) - 1
-    while i:
-        cached = matcher_from_tokens(match[i])
-        if cached[EXPANDO]:
-            set_matchers.append(cached)
-        else:
-            element_matchers.append(cached)
-    cached = matcher_from_group_matchers(element_matchers, set_matchers)
+    group_matchers = list()
+    groups = list()
+    for tokens in match:
+        siblings = tokens[0]['type'] in ('+', '~')
+        matcher = matcher_from_tokens(tokens)
+        group_matchers.append((_candidate_finder(tokens), matcher,
+                               siblings))
+        groups.append((_compound_kinds(tokens).get('TAG'), matcher,
+                       siblings))
+    cached = matcher_from_group_matchers(group_matchers)
+    cached.groups = groups
     compile_selector.cache[selector] = cached
-    #cached.selector = selector
     return cached
-compile_selector.cache = dict()
+if not hasattr(compile_selector, 'cache'):
+    compile_selector.cache = LRUCache(256)
 
 
 def tokenize(selector, parse_only=False):
-    """Tokenize..."""
+    """Split the selector into groups (separated by commas) of
+    tokens. Each token is a dictionary with the matched `value`, its
+    `type` (a combinator or a key of EXPR['filter']) and the
+    `matches` to be passed to the corresponding filter. If
+    `parse_only` is True then it returns the number of characters
+    that could not be parsed. """
     try:
         cached = tokenize.cache[selector]
     except KeyError:
@@ -266,26 +837,27 @@ def tokenize(selector, parse_only=False):
         match = RCOMMA.match(so_far)
         if not matched or match:
             if match:
-                match = match.groups()
-                so_far = so_far[len(match[0]):] or so_far
+                so_far = so_far[len(match.group(0)):] or so_far
             tokens = list()
             groups.append(tokens)
         matched = False
         match = RCOMBINATORS.match(so_far)
         if match:
             matched = match.group(0)
-            match = list(match.groups())
             tokens.append({
                 'value': matched,
-                'type': match[0].strip(),
+                'type': match.group(1).strip() or ' ',
             })
             so_far = so_far[len(matched):]
-        for ftype in EXPR['filter']:
+        for ftype in FILTER_ORDER:
             match = MATCH_EXPR[ftype].match(so_far)
             if match:
-                matched = match.group(0)
-                match = list(match.groups())
-                #match = pre_filters[ftype](match).groups()
+                match = [match.group(0)] + list(match.groups())
+                if ftype in pre_filters:
+                    match = pre_filters[ftype](match)
+                    if match is None:
+                        continue
+                matched = match.pop(0)
                 tokens.append({
                     'value': matched,
                     'type': ftype,
@@ -296,11 +868,12 @@ def tokenize(selector, parse_only=False):
             break
     if parse_only:
         return len(so_far)
-    else:
-        tokenize.cache[selector] = groups
-        return tokenize.cache[selector]
+    if so_far:
+        raise ValueError("unrecognized expression: %s" % so_far)
+    tokenize.cache[selector] = groups
+    return groups
 if not hasattr(tokenize, 'cache'):
-    tokenize.cache = dict()
+    tokenize.cache = LRUCache(256)
 
 
 class Selector(object):
@@ -309,6 +882,42 @@ class Selector(object):
     def __init__(self, selector, node, results=None):
         self.data = sizzle(selector, node, results)
 
+    @staticmethod
+    def match_many(node, selectors):
+        """Return a list with the results of each selector in
+        `selectors` applied to `node`. The selectors are compiled
+        together and checked on every element while the descendants
+        of the node are traversed once. Each list of results is in
+        tree order. """
+        results = [list() for _ in selectors]
+        by_name = dict()
+        generic = list()
+        for num, selector in enumerate(selectors):
+            compiled = compile_selector(selector.strip())
+            if any(siblings for _, _, siblings in compiled.groups):
+                # the candidates are not descendants of the node
+                compiled(None, node, results[num])
+                continue
+            for tag, matcher, _ in compiled.groups:
+                if tag is None:
+                    generic.append((num, matcher))
+                else:
+                    by_name.setdefault(tag, list()).append((num, matcher))
+        if not by_name and not generic:
+            return results
+        for elem in _get_elements(node):
+            matched = None
+            for entries in (by_name.get(elem.name, ()), generic):
+                for num, matcher in entries:
+                    if matched is not None and num in matched:
+                        continue
+                    if matcher(elem, node):
+                        results[num].append(elem)
+                        if matched is None:
+                            matched = set()
+                        matched.add(num)
+        return results
+
     def __getitem__(self, k):
         """Return the k-th element selected.
 
@@ -332,6 +941,11 @@ class Selector(object):
         self.data = list()
         for node in current:
             sizzle(selector, node, self.data)
+        if len(current) > 1:
+            unique = dict()
+            for node in self.data:
+                unique[id(node)] = node
+            self.data = sort_in_tree_order(unique.values())
         return self
 
     def contents(self):
@@ -10,9 +10,13 @@ desire.
 """
 
 import re
+from weakref import WeakKeyDictionary
 from cStringIO import StringIO
 from lexor.command.lang import get_style_module
+from lexor.command.lang import style_stamp, style_stamp_is_current
 from lexor.command import config
+from lexor.core.node import Node
+from lexor.core.elements import CharacterData, Element
 RE = re.compile(" ")
 
 
@@ -39,16 +43,53 @@ def replace(string, *key_val):
     return _replacer(*key_val)(string)
 
 
-def find_whitespace(line, start, lim):
+def find_whitespace(line, start, lim, offset=0):
     """Attempts to find the index of the first whitespace before
-    lim, if its not found, then it looks ahead. """
-    index = line.rfind(' ', start, lim+1)
+    lim, if its not found, then it looks ahead. The search is done
+    on `line[offset:]` without copying it, the returned index is
+    relative to `offset`. """
+    size = len(line) - offset
+    stop = lim + 1
+    if stop < 0:
+        stop = max(stop + size, 0)
+    index = line.rfind(' ', offset + start, offset + stop)
     if index != -1:
-        return index
-    index = line.find(' ', lim)
+        return index - offset
+    if lim < 0:
+        lim = max(lim + size, 0)
+    index = line.find(' ', offset + lim)
     if index != -1:
-        return index
-    return len(line)
+        return index - offset
+    return size
+
+
+def _overridden(method, base):
+    """Helper function for `Writer._get_record`. Returns None if
+    `method` is the implementation given by `base`, otherwise it
+    returns `method`. """
+    if getattr(method, 'im_func', None) is base.im_func:
+        return None
+    return method
+
+
+class _ListFile(object):
+    """A file like object which stores the strings written to it in
+    a list. Used by `Writer.iter_write`. """
+
+    def __init__(self, data):
+        self.data = data
+
+    def write(self, string):
+        """Append the string to the list. """
+        self.data.append(string)
+
+    def getvalue(self):
+        """Return the strings which have not been consumed. """
+        return ''.join(self.data)
+
+    def close(self):
+        """Nothing to close. """
+        pass
 
 
 class NodeWriter(object):
@@ -123,6 +164,8 @@ class DefaultWriter(NodeWriter):
 class Writer(object):
     """To see the languages in which a `Writer` object is able to
     write see the `lexor.lang` module. """
+    _pool = dict()  # Idle writers by (lang, style, defaults)
+    pool_size = 4  # Maximum number of idle writers per key
 
     def __init__(self, lang='xml', style='default', defaults=None):
         """Create a new `Writer` by specifying the language and the
@@ -136,11 +179,24 @@ class Writer(object):
         self._filename = None
         self._file = None  # Points to a file object
         self._nw = None    # Array of NodeWriters
+        self._records = dict()  # Methods of the NodeWriters by name
         self._reload = True  # Create new NodeWriters
+        self._chunks = []  # Strings waiting to be written to the file
+        self._chunks_len = 0
+        self._pending = ()  # Output not yet yielded by iter_write
+        self._cache = None  # Output of subtrees, see enable_cache
+        self._pool_key = None  # Set by acquire
+        self._style_stamp = None  # Identifies the loaded style module
+        self._record = None  # Strings written since the first capture
+        self._captures = []  # Subtrees whose output is being recorded
+        self.chunk_size = 8192
 
         self._raw = None
         self._wrap = None
         self._buffer = None
+        self._pieces = None  # Strings not yet joined to the buffer
+        self._pieces_len = None
+        self._stalled = None  # The buffer has no place to break
         self._break_hint = None
         self._indent = None
         self._indent_empty = None
@@ -176,6 +232,8 @@ class Writer(object):
     def indent(self, value):
         """_indent setter method. """
         self.flush_buffer(tail=False)
+        if value != self._indent:
+            self._spoil_captures()
         self._indent = value
 
     @property
@@ -193,12 +251,55 @@ class Writer(object):
     def string_buffer(self):
         """The current string buffer. This is the string that will
         be printed after its length exceeds the writer's width. """
+        self._join_buffer()
         return self._buffer
 
     @string_buffer.setter
     def string_buffer(self, value):
         """_indent setter method. """
+        self._join_buffer()
         self._buffer = value
+        self._stalled = False
+
+    @staticmethod
+    def acquire(lang='xml', style='default', defaults=None):
+        """Return a `Writer` for the given language, style and
+        defaults. The writer is taken from a pool of writers which
+        have already loaded their style so that writing small nodes
+        does not pay for creating a new writer each time. Give the
+        writer back with `release` once its output has been
+        retrieved and do not change its language or style.
+
+        Idle writers whose style module has been reloaded, removed
+        from the style cache or modified since it was loaded are
+        discarded. """
+        key = (lang, style)
+        if defaults:
+            key += tuple(sorted(defaults.iteritems()))
+        idle = Writer._pool.get(key)
+        while idle:
+            writer = idle.pop()
+            if writer.style_module is None or \
+                    style_stamp_is_current(writer._style_stamp):
+                return writer
+        if defaults:
+            defaults = dict(defaults)
+        writer = Writer(lang, style, defaults)
+        writer._pool_key = key
+        return writer
+
+    def release(self):
+        """Close the writer and return it to the pool if it was
+        obtained with `acquire`. """
+        self.close()
+        self._file = None
+        self._filename = None
+        self.root = None
+        if self._pool_key is None:
+            return
+        idle = Writer._pool.setdefault(self._pool_key, list())
+        if len(idle) < Writer.pool_size:
+            idle.append(self)
 
     def set(self, lang, style, defaults=None):
         """Set the language and style in one call. """
@@ -209,6 +310,7 @@ class Writer(object):
 
     def __str__(self):
         """Attempts to retrieve the last written string. """
+        self.flush_chunks()
         if self._filename is None and self._file is not None:
             return self._file.getvalue()
         if self._filename is not None:
@@ -219,16 +321,30 @@ class Writer(object):
         return None
 
     def _write_str(self, string):
-        """Helper function for write_str. """
+        """Helper function for write_str. The string is stored in a
+        list of chunks which gets written to the file once their
+        total length reaches `chunk_size`. """
         if string != '':
             self.prev_str = string
-            self._file.write(string)
-            nlines = string.count('\n')
-            self.pos[0] += nlines
-            if nlines > 0:
-                self.pos[1] = len(string) - string.rfind('\n')
-            else:
+            if self._record is not None:
+                self._record.append(string)
+            self._chunks.append(string)
+            self._chunks_len += len(string)
+            index = string.rfind('\n')
+            if index == -1:
                 self.pos[1] += len(string)
+            else:
+                self.pos[0] += string.count('\n', 0, index) + 1
+                self.pos[1] = len(string) - index
+            if self._chunks_len >= self.chunk_size:
+                self.flush_chunks()
+
+    def flush_chunks(self):
+        """Write the pending chunks to the file object. """
+        if self._chunks:
+            self._file.write(''.join(self._chunks))
+            self._chunks = []
+            self._chunks_len = 0
 
     def write_str(self, string, split=False):
         """The write function is meant to be used with Node objects.
@@ -255,16 +371,51 @@ class Writer(object):
         lines = string.split('\n')
         num = 0
         while num < len(lines) - 1:
-            self._buffer += lines[num]
-            self.normalize_buffer()
+            self._extend_buffer(lines[num])
             self.flush_buffer()
             self._write_str('\n')
             num += 1
-        self._buffer += lines[num]
+        self._extend_buffer(lines[num])
+
+    def _extend_buffer(self, string):
+        """HELPER-METHOD: Appends `string` to the buffer and normalizes
+        it. The strings are kept in a list while the buffer fits in
+        the line or while `normalize_buffer` has no place to break it:
+        the buffer has no whitespace, `string` adds none and no break
+        hint appears within the line. They are joined once the buffer
+        needs to be normalized. """
+        self._pieces.append(string)
+        self._pieces_len += len(string)
+        indent = self._indent
+        if self.pos[1] > 1:
+            indent = ''
+        limit = self.width - self.pos[1] - len(indent) + 1
+        if len(self._buffer) + self._pieces_len <= limit:
+            return
+        if self._stalled and limit >= 1 and ' ' not in string:
+            line = self._buffer
+            start = 1 if line[0] == ' ' else 0
+            for hint in self._break_hint:
+                stop = limit + len(hint)
+                if stop > len(line) or line.find(hint, start, stop) > -1:
+                    break
+            else:
+                del self._break_hint[:]
+                return
         self.normalize_buffer()
 
+    def _join_buffer(self):
+        """HELPER-METHOD: Joins the strings appended to the buffer by
+        `write_str`. """
+        if self._pieces:
+            self._buffer += ''.join(self._pieces)
+            self._pieces = []
+            self._pieces_len = 0
+
     def flush_buffer(self, tail=True):
         """Empty the contents of the buffer. """
+        self._join_buffer()
+        self._stalled = False
         if not tail and self._buffer.endswith(' '):
             self._buffer = self._buffer[:-1]
         if self.pos[1] == 1:
@@ -281,50 +432,80 @@ class Writer(object):
     def normalize_buffer(self):
         """The term normalize means that the length of the buffer
         will be less than or equal to the wrapping width. Anything
-        that exceeds the limit will be flushed. """
+        that exceeds the limit will be flushed.
+
+        The buffer is traversed with an offset instead of being sliced
+        after each line and the break hints are only searched up to the
+        limit, this keeps the work linear in the length of the buffer.
+        """
+        self._join_buffer()
+        self._stalled = False
         line = self._buffer
+        size = len(line)
+        off = 0
         indent = self._indent
         if self.pos[1] > 1:
             indent = ''
         limit = self.width - self.pos[1] - len(indent) + 1
-        while len(line) > limit:
+        while size - off > limit:
             start = 0
-            if line[start] == ' ':
+            if line[off] == ' ':
                 start += 1
-            end = find_whitespace(line, start, limit)
-            while self._break_hint:
-                index = line.find(self._break_hint[0], start)
-                del self._break_hint[0]
-                if index > -1 and index <= limit:
-                    if end > limit or index > end:
-                        end = index
-            if end == len(line):
+            end = find_whitespace(line, start, limit, off)
+            if self._break_hint:
+                if limit >= 0:
+                    for hint in self._break_hint:
+                        index = line.find(hint, off + start,
+                                          off + limit + len(hint))
+                        if index > -1:
+                            index -= off
+                            if end > limit or index > end:
+                                end = index
+                del self._break_hint[:]
+            if end == size - off:
+                # No whitespace after `start`, appending strings
+                # without whitespace will not change the buffer.
+                self._stalled = limit >= 1
                 break
-            self._write_str(indent + line[start:end] + '\n')
-            if line[end:end+1] == ' ':
-                line = line[end+1:]
+            self._write_str(indent + line[off+start:off+end] + '\n')
+            if line[off+end:off+end+1] == ' ':
+                off += end + 1
             else:
-                line = line[end:]
+                off += end
             indent = self._indent
             limit = self.width - self.pos[1] - len(indent) + 1
+        if off:
+            line = line[off:]
         self._buffer = line
 
     def enable_wrap(self):
         """Use this to set the writing in wrapping mode. """
+        self.flush_chunks()
+        if not self._wrap:
+            self._spoil_captures()
         self._wrap = True
 
     def disable_wrap(self):
         """Turn off wrapping. """
         self.flush_buffer()
+        self.flush_chunks()
+        if self._wrap:
+            self._spoil_captures()
         self._wrap = False
 
     def enable_raw(self):
         """Use this to set the writing in raw mode. """
         self.flush_buffer()
+        self.flush_chunks()
+        if not self._raw:
+            self._spoil_captures()
         self._raw = True
 
     def disable_raw(self):
         """Turn off raw mode. """
+        self.flush_chunks()
+        if self._raw:
+            self._spoil_captures()
         self._raw = False
 
     def raw_enabled(self):
@@ -335,6 +516,86 @@ class Writer(object):
         """Determine if wrap mode is enabled or not. """
         return self._wrap
 
+    def enable_cache(self):
+        """Save the output of the elements written in raw mode. An
+        element which has not been modified since then, see
+        `Node.touch`, is not traversed the next time it is written in
+        raw mode, its saved output is written instead.
+
+        The output of an element is not saved if the writing mode or
+        the indentation change while it is written or if its node
+        writers check the last written string before the element
+        writes anything. The node writers are assumed not to depend
+        on anything else written before the element, such as `pos`.
+
+        Inserting or removing a node touches its parent and the
+        siblings whose `prev` or `next` changed, but not the siblings
+        which only shifted position. The output of an element whose
+        node writers depend on its `index`, for instance to number
+        list items, or on siblings other than `prev` and `next` may
+        therefore be stale; do not enable the cache for such styles.
+
+        The saved output is held through weak references to the
+        elements so it is discarded once an element is no longer
+        used. """
+        if self._cache is None:
+            self._cache = WeakKeyDictionary()
+
+    def disable_cache(self):
+        """Stop saving the output of the elements and discard the
+        saved output. """
+        self._cache = None
+
+    def cache_enabled(self):
+        """Determine if the output of the elements is being saved. """
+        return self._cache is not None
+
+    def _use_cache(self, node):
+        """HELPER-METHOD: Writes the saved output of `node` and
+        returns True. If the output has not been saved or the node
+        has been modified then it starts recording its output and
+        returns False. """
+        entry = self._cache.get(node)
+        if entry is not None and entry[0] == node._revision:
+            if entry[1]:
+                self._write_str(entry[1])
+                self.prev_str = entry[2]
+            return True
+        if self._record is None:
+            self._record = list()
+        self._captures.append([node, len(self._record), node._revision])
+        return False
+
+    def _save_cache(self, node, store=True):
+        """HELPER-METHOD: Stops recording the output of `node` and
+        saves it if `store` is True and the recording has not been
+        spoiled. """
+        if not self._captures or self._captures[-1][0] is not node:
+            return
+        _, start, revision = self._captures.pop()
+        if store and revision is not None and revision == node._revision:
+            record = self._record
+            text = ''.join(record[start:])
+            if text:
+                record[start:] = [text]
+                self._cache[node] = (revision, text, self.prev_str)
+            else:
+                self._cache[node] = (revision, text, None)
+        if not self._captures:
+            self._record = None
+
+    def _spoil_captures(self, empty=False):
+        """HELPER-METHOD: Prevents the output being recorded from
+        being saved. If `empty` is True then only the recordings
+        to which nothing has been written are spoiled. """
+        if not self._captures:
+            return
+        size = len(self._record)
+        for capture in reversed(self._captures):
+            if empty and capture[1] != size:
+                break
+            capture[2] = None
+
     def endl(self, force=True, tot=1, tail=False):
         """Insert a new line character. By setting `force` to False
         you may omit inserting a new line character if the last
@@ -348,6 +609,8 @@ class Writer(object):
     def last(self):
         """Returns the last written string with the contents of the
         buffer. """
+        self._spoil_captures(empty=True)
+        self._join_buffer()
         if self.pos[1] == 1 and self._buffer.startswith(' '):
             return self.prev_str + self._buffer[1:]
         return self.prev_str + self._buffer
@@ -378,10 +641,65 @@ class Writer(object):
         else:
             self._filename = filename
             self._file = open(filename, mode)
+        self._start_write(node)
+        self._write(node)
+        self._end_write(node)
+        if isinstance(filename, file):
+            pass
+        elif filename is not None:
+            self._file.close()
+
+    def iter_write(self, node, chunk_size=8192):
+        """Generator version of `write`. The output is yielded in
+        strings of about `chunk_size` characters as the node is
+        traversed. Use this to send large documents to a stream
+        without keeping the whole output in memory:
+
+            for chunk in writer.iter_write(doc):
+                stream.write(chunk)
+
+        The output is not stored by the writer, `__str__` will return
+        an empty string afterwards. """
+        if self._filename is None and self._file is not None:
+            self._file.close()
+        pending = list()
+        self._filename = None
+        self._file = _ListFile(pending)
+        size = self.chunk_size
+        self.chunk_size = chunk_size
+        try:
+            self._start_write(node)
+            self._pending = pending
+            for _ in self._walk(node):
+                chunk = ''.join(pending)
+                del pending[:]
+                yield chunk
+            self._end_write(node)
+        finally:
+            self._pending = ()
+            self.chunk_size = size
+        if pending:
+            chunk = ''.join(pending)
+            del pending[:]
+            yield chunk
+
+    def _start_write(self, node):
+        """Helper function for write and iter_write. Sets the state
+        of the writer and calls the `pre_process` function of the
+        style. """
         self.root = node
+        if self._cache is not None:
+            Node.revision += 1
+        self._record = None
+        self._captures = []
+        self._chunks = []
+        self._chunks_len = 0
         self._raw = True
         self._wrap = False
         self._buffer = ''
+        self._pieces = []
+        self._pieces_len = 0
+        self._stalled = False
         self._break_hint = []
         self._indent = ''
         self._indent_empty = False
@@ -394,27 +712,48 @@ class Writer(object):
         self._set_node_writers_writer()
         if hasattr(self.style_module, 'pre_process'):
             self.style_module.pre_process(self, node)
-        self._write(node)
+
+    def _end_write(self, node):
+        """Helper function for write and iter_write. Calls the
+        `post_process` function of the style and writes the pending
+        chunks. """
+        if self._cache is not None:
+            Node.revision += 1
         self.flush_buffer()
         if hasattr(self.style_module, 'post_process'):
             self.style_module.post_process(self, node)
-        if isinstance(filename, file):
-            pass
-        elif filename is not None:
+        self.flush_chunks()
+
+    def write_nodes(self, nodes):
+        """Write each of the nodes to a string as `write` would and
+        join their outputs. Use the __str__ function to retrieve the
+        result. """
+        self._filename = None
+        if self._file is not None:
             self._file.close()
+        self._file = StringIO()
+        for node in nodes:
+            self._start_write(node)
+            self._write(node)
+            self._end_write(node)
 
     def close(self):
         """Close the file. """
-        if self._filename is not file:
+        self.flush_chunks()
+        if self._filename is not file and self._file is not None:
             self._file.close()
 
     def _set_node_writers(self, lang, style, defaults=None):
         """Imports the correct module based on the language and
         style. """
         self.style_module = get_style_module('writer', lang, style)
+        self._style_stamp = style_stamp(self.style_module)
         name = '%s-writer-%s' % (lang, style)
         config.set_style_cfg(self, name, defaults)
         self._nw = dict()
+        self._records = dict()
+        if self._cache is not None:
+            self._cache = WeakKeyDictionary()
         self._nw['__default__'] = DefaultWriter(self)
         nw_obj = NodeWriter(self)
         self._nw['#document'] = nw_obj
@@ -445,58 +784,63 @@ class Writer(object):
         for key in self._nw:
             self._nw[key].writer = self
 
-    def _write_start(self, node):
-        """To be called during tree traversal when node is first
-        encountered. """
-        self._nw.get(node.name, self._nw['__default__']).start(node)
-
-    def _write_data(self, node):
-        """To be called during tree traversal after _write_start if the
-        node is a `CharacterData`. """
-        self._nw.get(node.name, self._nw['__default__']).data(node)
-
-    def _write_child(self, node):
-        """To be called during tree traversal after _write_start if the
-        node has children. """
-        return self._nw.get(node.name, self._nw['__default__']).child(node)
-
-    def _write_end(self, node):
-        """To be called during tree traversal on last visit to node. """
-        self._nw.get(node.name, self._nw['__default__']).end(node)
-
-    def _get_direction(self, crt):
-        """Returns the direction in which the traversal should go. """
-        if hasattr(crt, 'data'):
-            self._write_data(crt)
-            self._write_end(crt)
-            return 'r'
-        elif crt.child:
-            if self._write_child(crt) is None:
-                return 'r'
-            else:
-                return 'd'
-        else:
-            self._write_end(crt)
-            return 'r'
+    def _get_record(self, name):
+        """Returns the tuple `(start, data, child, end)` of bound
+        methods of the `NodeWriter` in charge of writing the nodes
+        named `name`. The methods left as they are defined in
+        `NodeWriter` are replaced by None since `start` and `end` do
+        nothing and `child` always returns True. """
+        nw_obj = self._nw.get(name, self._nw['__default__'])
+        record = (
+            _overridden(nw_obj.start, NodeWriter.start),
+            nw_obj.data,
+            _overridden(nw_obj.child, NodeWriter.child),
+            _overridden(nw_obj.end, NodeWriter.end),
+        )
+        self._records[name] = record
+        return record
 
     def _write(self, root):
         """To be called during actual write function. """
+        for _ in self._walk(root):
+            pass
+
+    def _walk(self, root):
+        """Generator which writes `root`. The methods of the
+        `NodeWriter` objects are looked up once per node name, see
+        `_get_record`. It yields between nodes whenever `iter_write`
+        has output waiting to be yielded. """
+        records = self._records
+        pending = self._pending
+        cache = self._cache
         crt = root
         direction = None
-        self._write_start(crt)
-        if hasattr(crt, 'data'):
-            self._write_data(crt)
-            self._write_end(crt)
+        if cache is not None and crt.child and self._raw and \
+                isinstance(crt, Element):
+            if self._use_cache(crt):
+                return
+        record = records.get(crt.name) or self._get_record(crt.name)
+        if record[0] is not None:
+            record[0](crt)
+        if isinstance(crt, CharacterData):
+            record[1](crt)
+            if record[3] is not None:
+                record[3](crt)
             return
         if crt.child:
-            if self._write_child(crt) is None:
+            if record[2] is not None and record[2](crt) is None:
+                if cache is not None:
+                    self._save_cache(crt, False)
                 return
             else:
                 direction = 'd'
         else:
-            self._write_end(crt)
+            if record[3] is not None:
+                record[3](crt)
             return
         while True:
+            if pending:
+                yield
             if direction is 'd':
                 crt = crt.child[0]
             elif direction is 'r':
@@ -505,12 +849,39 @@ class Writer(object):
                     continue
                 crt = crt.next
             elif direction is 'u':
-                self._write_end(crt.parent)
-                if crt.parent is root:
+                crt = crt.parent
+                record = (records.get(crt.name) or
+                          self._get_record(crt.name))
+                if record[3] is not None:
+                    record[3](crt)
+                if cache is not None:
+                    self._save_cache(crt)
+                if crt is root:
                     break
-                if crt.parent.next is None:
-                    crt = crt.parent
+                if crt.next is None:
                     continue
-                crt = crt.parent.next
-            self._write_start(crt)
-            direction = self._get_direction(crt)
+                crt = crt.next
+            if cache is not None and crt.child and self._raw and \
+                    isinstance(crt, Element):
+                if self._use_cache(crt):
+                    direction = 'r'
+                    continue
+            record = records.get(crt.name) or self._get_record(crt.name)
+            if record[0] is not None:
+                record[0](crt)
+            if isinstance(crt, CharacterData):
+                record[1](crt)
+                if record[3] is not None:
+                    record[3](crt)
+                direction = 'r'
+            elif crt.child:
+                if record[2] is not None and record[2](crt) is None:
+                    if cache is not None:
+                        self._save_cache(crt, False)
+                    direction = 'r'
+                else:
+                    direction = 'd'
+            else:
+                if record[3] is not None:
+                    record[3](crt)
+                direction = 'r'